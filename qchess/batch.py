@@ -0,0 +1,263 @@
+"""
+Batch Evaluation
+
+Scores many boards at once with NumPy, for offline work like generating
+datasets or triaging big FEN/EPD dumps. The boards are turned into arrays of
+bitboards and every evaluation term is computed over the whole batch at once,
+giving exactly the same scores as score_board in qchess.py.
+
+NumPy is only needed here, the engine itself doesn't use it.
+
+Usage: python batch.py [file.epd] (reads FEN/EPD lines from stdin without a file)
+"""
+
+import sys
+
+import chess
+from chess import WHITE, BLACK, PAWN, BISHOP, ROOK, QUEEN, KING
+import numpy as np
+
+from const import *
+
+
+# Boards are converted and scored this many at a time to keep memory use bounded
+BATCH_SIZE = 1 << 16
+
+U64 = np.uint64
+
+BB_ALL = U64(chess.BB_ALL)
+NOT_FILE_A = U64(chess.BB_ALL & ~chess.BB_FILE_A)
+NOT_FILE_H = U64(chess.BB_ALL & ~chess.BB_FILE_H)
+
+# Slider ray directions as (shift, squares a piece can land on after the shift without wrapping around the board)
+DIAGONAL_DIRECTIONS = ((9, NOT_FILE_A), (7, NOT_FILE_H), (-7, NOT_FILE_A), (-9, NOT_FILE_H))
+STRAIGHT_DIRECTIONS = ((8, BB_ALL), (-8, BB_ALL), (1, NOT_FILE_A), (-1, NOT_FILE_H))
+
+# The scalar tables from const.py as arrays
+PIECE_SQUARE_ARRAYS = tuple(
+	tuple(
+		(None,) + tuple(np.array(PIECE_SQUARE_VALUES[phase][color][piece_type], dtype=np.int64) for piece_type in range(PAWN, KING+1))
+		for color in (BLACK, WHITE)
+	)
+	for phase in (MIDGAME, ENDGAME)
+)
+
+MOBILITY_ARRAYS = tuple(
+	tuple(np.array(PIECE_MOBILITY_TABLES[piece_type][phase], dtype=np.int64) for phase in (MIDGAME, ENDGAME)) if piece_type else None
+	for piece_type in range(KING+1)
+)
+
+# Passed pawn bonus for every square, by the rank relative to each color, [phase][color][square]
+PASSED_PAWN_ARRAYS = tuple(
+	tuple(
+		np.array([PASSED_PAWN_BONUS[phase][chess.square_rank(square) if color == WHITE else 7 - chess.square_rank(square)] for square in range(64)], dtype=np.int64)
+		for color in (BLACK, WHITE)
+	)
+	for phase in (MIDGAME, ENDGAME)
+)
+
+
+## Bitboard helpers ##
+# The same as the ones in util.py, but working on arrays of unsigned 64 bit bitboards
+
+def shift(bb, amount):
+	return bb << U64(amount) if amount > 0 else bb >> U64(-amount)
+
+def popcount(bb):
+	bb = bb - ((bb >> U64(1)) & U64(0x5555555555555555))
+	bb = (bb & U64(0x3333333333333333)) + ((bb >> U64(2)) & U64(0x3333333333333333))
+	bb = (bb + (bb >> U64(4))) & U64(0x0F0F0F0F0F0F0F0F)
+	return ((bb * U64(0x0101010101010101)) >> U64(56)).astype(np.int64)
+
+def north_fill(bb):
+	bb = bb | (bb << U64(8))
+	bb = bb | (bb << U64(16))
+	return bb | (bb << U64(32))
+
+def south_fill(bb):
+	bb = bb | (bb >> U64(8))
+	bb = bb | (bb >> U64(16))
+	return bb | (bb >> U64(32))
+
+def file_set(bb):
+	return south_fill(bb) & U64(0xFF)
+
+def adjacent_files(bb):
+	return ((bb & NOT_FILE_A) >> U64(1)) | ((bb & NOT_FILE_H) << U64(1))
+
+def squares(bb): # (N, 64) array of 0 and 1 for each square of each bitboard
+	return np.unpackbits(bb.astype("<u8").view(np.uint8).reshape(-1, 8), axis=1, bitorder="little")
+
+def slider_attacks(pieces, empty, directions):
+	"""
+	Kogge-Stone fill of every ray from the pieces until (and including)
+	the first occupied square, the same squares the python-chess attack
+	tables give for a piece on its own
+	"""
+
+	attacks = np.zeros_like(pieces)
+
+	for amount, mask in directions:
+		generator = pieces
+		propagator = empty & mask
+
+		generator = generator | (propagator & shift(generator, amount))
+		propagator = propagator & shift(propagator, amount)
+		generator = generator | (propagator & shift(generator, amount * 2))
+		propagator = propagator & shift(propagator, amount * 2)
+		generator = generator | (propagator & shift(generator, amount * 4))
+
+		attacks = attacks | (shift(generator, amount) & mask)
+
+	return attacks
+
+
+def board_arrays(boards):
+	"""
+	Converts boards into arrays of their bitboards, returns a tuple of
+	(piece bitboards [N, piece_type], color bitboards [color][N], turns [N])
+	"""
+
+	pieces = np.array([
+		(0, board.pawns, board.knights, board.bishops, board.rooks, board.queens, board.kings)
+		for board in boards
+	], dtype=U64).reshape(-1, KING+1)
+	occupied_co = np.array([board.occupied_co for board in boards], dtype=U64).reshape(-1, 2)
+	colors = (occupied_co[:, 0], occupied_co[:, 1]) # indexed by color like board.occupied_co
+	turns = np.array([board.turn for board in boards], dtype=bool)
+
+	return pieces, colors, turns
+
+
+def draw_mask(boards):
+	# Draw detection needs legal move generation and the move history, so it stays per board
+	return np.array([
+		board.is_repetition() or board.halfmove_clock >= 100 or board.is_insufficient_material() or board.is_stalemate()
+		for board in boards
+	], dtype=bool)
+
+
+def score_arrays(pieces, colors, turns):
+	"""
+	Batch Board Evaluation
+
+	Vectorized version of score_board, takes the arrays from board_arrays
+	and returns each boards score from the perspective of the player to move.
+	Every term is summed as exact integers in the same order as score_board
+	so even the rounding of the phase tapering comes out the same.
+	"""
+
+	count = len(turns)
+	mg = np.zeros(count, dtype=np.int64)
+	eg = np.zeros(count, dtype=np.int64)
+	remaining = np.zeros(count, dtype=np.int64)
+
+	occupied = colors[WHITE] | colors[BLACK]
+	empty = ~occupied
+
+	for color in (WHITE, BLACK):
+		color_mod = COLOR_MOD[color]
+
+		# Material, piece square tables, will to push and static mobility, the terms the board keeps incrementally
+		for piece_type in range(PAWN, KING+1):
+			piece_squares = squares(pieces[:, piece_type] & colors[color])
+			mg += piece_squares @ PIECE_SQUARE_ARRAYS[MIDGAME][color][piece_type]
+			eg += piece_squares @ PIECE_SQUARE_ARRAYS[ENDGAME][color][piece_type]
+			remaining += piece_squares.sum(axis=1, dtype=np.int64) * GAME_PHASE_WEIGHTS[piece_type]
+
+		# Mobility of sliding pieces, one entry per piece on any board
+		for piece_type, directions in ((BISHOP, (DIAGONAL_DIRECTIONS,)), (ROOK, (STRAIGHT_DIRECTIONS,)), (QUEEN, (DIAGONAL_DIRECTIONS, STRAIGHT_DIRECTIONS))):
+			board_index, square = np.nonzero(squares(pieces[:, piece_type] & colors[color]))
+			if not len(board_index):
+				continue
+
+			slider = U64(1) << square.astype(U64)
+			num_attacks = sum(popcount(slider_attacks(slider, empty[board_index], ray)) for ray in directions)
+
+			mg += np.bincount(board_index, MOBILITY_ARRAYS[piece_type][MIDGAME][num_attacks] * color_mod, minlength=count).astype(np.int64)
+			eg += np.bincount(board_index, MOBILITY_ARRAYS[piece_type][ENDGAME][num_attacks] * color_mod, minlength=count).astype(np.int64)
+
+		# Reward having both bishops
+		bishop_pair = popcount(pieces[:, BISHOP] & colors[color]) >= 2
+		mg += bishop_pair * (DOUBLE_BISHOP_BONUS[MIDGAME] * color_mod)
+		eg += bishop_pair * (DOUBLE_BISHOP_BONUS[ENDGAME] * color_mod)
+
+	# Pawn structure
+	white_pawns = pieces[:, PAWN] & colors[WHITE]
+	black_pawns = pieces[:, PAWN] & colors[BLACK]
+
+	white_blockers = south_fill(black_pawns >> U64(8))
+	white_blockers |= adjacent_files(white_blockers)
+	black_blockers = north_fill(white_pawns << U64(8))
+	black_blockers |= adjacent_files(black_blockers)
+
+	for color, pawns, blockers, defenders in (
+		(WHITE, white_pawns, white_blockers, ((white_pawns & NOT_FILE_A) << U64(7)) | ((white_pawns & NOT_FILE_H) << U64(9))),
+		(BLACK, black_pawns, black_blockers, ((black_pawns & NOT_FILE_A) >> U64(9)) | ((black_pawns & NOT_FILE_H) >> U64(7)))
+	):
+		color_mod = COLOR_MOD[color]
+
+		stacked = pawns & south_fill(pawns >> U64(8))
+		tripled_files = file_set(stacked & south_fill(stacked >> U64(8)))
+		doubled_files = file_set(stacked) & ~tripled_files
+
+		doubled = popcount(doubled_files)
+		tripled = popcount(tripled_files)
+		mg += (DOUBLED_PAWN_PENALTY[MIDGAME] * doubled + TRIPLED_PAWN_PENALTY[MIDGAME] * tripled) * color_mod
+		eg += (DOUBLED_PAWN_PENALTY[ENDGAME] * doubled + TRIPLED_PAWN_PENALTY[ENDGAME] * tripled) * color_mod
+
+		files = file_set(pawns)
+		isolated = popcount(files & ~adjacent_files(files))
+		mg += ISOLATED_PAWN_PENALTY[MIDGAME] * isolated * color_mod
+		eg += ISOLATED_PAWN_PENALTY[ENDGAME] * isolated * color_mod
+
+		chained = popcount(pawns & defenders)
+		mg += PAWN_CHAIN_BONUS[MIDGAME] * chained * color_mod
+		eg += PAWN_CHAIN_BONUS[ENDGAME] * chained * color_mod
+
+		passed = squares(pawns & ~blockers)
+		mg += (passed @ PASSED_PAWN_ARRAYS[MIDGAME][color]) * color_mod
+		eg += (passed @ PASSED_PAWN_ARRAYS[ENDGAME][color]) * color_mod
+
+	# Game phase tapering, the same float math and truncation as lerp
+	phase = np.clip((GAME_PHASE_TOTAL - remaining) / GAME_PHASE_TOTAL, 0, 1)
+	score = np.trunc((1 - phase) * mg + phase * eg).astype(np.int64)
+
+	score *= np.where(turns, COLOR_MOD[WHITE], COLOR_MOD[BLACK])
+
+	score += np.trunc((1 - phase) * TEMPO_BONUS[MIDGAME] + phase * TEMPO_BONUS[ENDGAME]).astype(np.int64)
+
+	return score
+
+
+def score_boards(boards):
+	"""
+	Scores a sequence of boards in batches, returns an array of their
+	scores from the perspective of the player to move
+	"""
+
+	scores = []
+
+	for start in range(0, len(boards), BATCH_SIZE):
+		batch = boards[start:start+BATCH_SIZE]
+		score = score_arrays(*board_arrays(batch))
+		score[draw_mask(batch)] = 0
+		scores.append(score)
+
+	return np.concatenate(scores) if scores else np.zeros(0, dtype=np.int64)
+
+
+if __name__ == "__main__":
+	lines = open(sys.argv[1]) if len(sys.argv) > 1 else sys.stdin
+
+	boards = []
+
+	for line in lines:
+		line = line.strip()
+		if line:
+			board = chess.Board()
+			board.set_epd(line) if len(line.split()) < 6 or ";" in line else board.set_fen(line)
+			boards.append(board)
+
+	for board, score in zip(boards, score_boards(boards)):
+		print(board.fen(), score)
@@ -1,4 +1,6 @@
-from chess import WHITE, KING, PAWN
+from chess import WHITE, BLACK, PAWN, KING, BB_A1, BB_H1, BB_A8, BB_H8, BB_PAWN_ATTACKS, BB_KNIGHT_ATTACKS, BB_KING_ATTACKS
+from chess import popcount, square_mirror, square_rank
+from chess.polyglot import POLYGLOT_RANDOM_ARRAY
 
 import math
 
@@ -21,6 +23,29 @@ LEAF_DIST = 1
 VALUE = 2
 BEST_MOVE = 3
 
+# Search statistics counters, indices into the stats list
+STAT_QNODES = 0
+STAT_EVALS = 1
+STAT_TT_PROBES = 2
+STAT_TT_HITS = 3
+STAT_TT_CUTOFFS = 4
+STAT_NULL_MOVE_SEARCHES = 5
+STAT_NULL_MOVE_CUTOFFS = 6
+STAT_FUTILITY_PRUNES = 7
+STAT_REVERSE_FUTILITY_CUTOFFS = 8
+STAT_LMR_REDUCTIONS = 9
+STAT_RESEARCHES = 10
+STAT_ASPIRATION_RESEARCHES = 11
+STAT_BETA_CUTOFFS = 12
+STAT_FIRST_MOVE_CUTOFFS = 13
+STAT_TB_HITS = 14
+
+STAT_NAMES = (
+	"qnodes", "evals", "tt_probes", "tt_hits", "tt_cutoffs", "null_move_searches", "null_move_cutoffs",
+	"futility_prunes", "reverse_futility_cutoffs", "lmr_reductions", "researches", "aspiration_researches",
+	"beta_cutoffs", "first_move_cutoffs", "tb_hits"
+)
+
 # PV Table Size
 PV_SIZE = 32
 
@@ -33,9 +58,102 @@ MAX_DEPTH = 100
 # Evaluation score for a white checkmate, basically +100.0
 CHECKMATE = 100_000
 
+# Score for a position the endgame tablebases say is won, below any mate score
+TABLEBASE_WIN = 90_000
+
 ## Transposition tables ##
-# Maximum amount of entries in the positional transposition table
-MAX_PTABLE_SIZE = 4_000_000
+# Size of the positional transposition table in megabytes, configurable with the UCI Hash option
+DEFAULT_HASH_SIZE = 64
+MIN_HASH_SIZE = 1
+MAX_HASH_SIZE = 4096
+
+# Every entry is two 64 bit words, the zobrist key and the packed data
+TT_ENTRY_SIZE = 16
+
+# Entries per bucket, the first slot is depth preferred and the second is always replaced
+TT_BUCKET_SIZE = 2
+
+# Generations wrap around after this many searches
+TT_GENERATIONS = 64
+
+# Bit layout of the packed data word, move (16 bits) | score (24 bits) | depth (8 bits) | flag (2 bits) | generation (6 bits)
+TT_SCORE_SHIFT = 16
+TT_DEPTH_SHIFT = 40
+TT_FLAG_SHIFT = 48
+TT_GENERATION_SHIFT = 50
+TT_SCORE_OFFSET = 1 << 23
+
+# Amount of entries sampled when reporting hashfull
+TT_HASHFULL_SAMPLE = 1000
+
+# Entries in the pawn structure cache, must be a power of two
+PAWN_TABLE_SIZE = 1 << 16
+
+# Entries in the static evaluation cache, must be a power of two
+EVAL_TABLE_SIZE = 1 << 18
+
+## Zobrist hashing ##
+# Polyglot zobrist keys split up so hashes can be updated incrementally, [color][piece_type][square]
+ZOBRIST_PIECE_KEYS = tuple(
+	(None,) + tuple(
+		tuple(POLYGLOT_RANDOM_ARRAY[64 * ((piece_type - 1) * 2 + color) + square] for square in range(64))
+		for piece_type in range(PAWN, KING+1)
+	)
+	for color in (BLACK, WHITE)
+)
+
+# Castling rights are keyed by the corner the rook castles with
+ZOBRIST_CASTLING_KEYS = (
+	(BB_H1, POLYGLOT_RANDOM_ARRAY[768]),
+	(BB_A1, POLYGLOT_RANDOM_ARRAY[769]),
+	(BB_H8, POLYGLOT_RANDOM_ARRAY[770]),
+	(BB_A8, POLYGLOT_RANDOM_ARRAY[771])
+)
+
+ZOBRIST_EP_KEYS = tuple(POLYGLOT_RANDOM_ARRAY[772 + file] for file in range(8))
+ZOBRIST_TURN_KEY = POLYGLOT_RANDOM_ARRAY[780]
+
+# Check every incrementally updated hash against a full polyglot hash, very slow, also toggled by the UCI debug command
+DEBUG_ZOBRIST = False
+
+## Lazy SMP ##
+# Maximum amount of search processes, set with the UCI Threads option
+MAX_THREADS = 256
+
+# Helper processes check if they should stop every this many nodes
+HELPER_POLL_NODES = 1024
+
+# Seconds the main search waits for the helpers to report once they're told to stop, checking every HELPER_RESULT_POLL seconds that they're still alive
+HELPER_RESULT_TIMEOUT = 1
+HELPER_RESULT_POLL = 0.05
+
+## Time management ##
+# Nodes searched between looking at the clock
+TIME_POLL_NODES = 256
+# Time in ms kept back for communication with the GUI
+TIME_MOVE_OVERHEAD = 30
+# Never plan to search for less than this many ms
+TIME_MIN_MOVETIME = 50
+# How many moves we plan the time we have left over if the time control doesn't tell us
+TIME_MOVES_HORIZON = 40
+# Share of the increment we use on top of our share of the clock
+TIME_INCREMENT_USAGE = 0.75
+# The hard limit is this many times our planned time, but never more than this share of the clock
+TIME_HARD_RATIO = 4
+TIME_MAX_USAGE = 0.4
+TIME_LAST_MOVE_USAGE = 0.9
+# Soft limit extension for each change of the best move, decaying every iteration
+TIME_BEST_MOVE_CHANGE_EXTENSION = 0.5
+TIME_INSTABILITY_DECAY = 0.5
+# A score drop of this many cp between iterations gives the full score drop extension
+TIME_SCORE_DROP_SCALE = 100
+TIME_SCORE_DROP_EXTENSION = 0.5
+# The soft limit is never stretched past this many times its size
+TIME_MAX_EXTENSION = 2.5
+# Bounds on how much longer we expect each iteration to take than the last
+TIME_DEFAULT_BRANCHING_FACTOR = 3
+TIME_MIN_BRANCHING_FACTOR = 1.5
+TIME_MAX_BRANCHING_FACTOR = 8
 
 ## Piece Values (-, p, n, b, r, q, k) ##
 PIECE_VALUES = (0, 1, 3, 3, 5, 9, 0) # pawns
@@ -58,6 +176,15 @@ DOUBLED_PAWN_PENALTY = (-7, -20) # cp
 TRIPLED_PAWN_PENALTY = (-12, -37) # cp
 ISOLATED_PAWN_PENALTY = (-7, -20)
 
+# Passed pawns are good, more so the further they are pushed, [phase][relative rank]
+PASSED_PAWN_BONUS = (
+	(0, 0, 5, 10, 20, 35, 55, 0), # midgame
+	(0, 10, 15, 25, 45, 75, 110, 0) # endgame
+)
+
+# Pawns defended by another pawn
+PAWN_CHAIN_BONUS = (8, 4) # cp
+
 # First depth to search in iterative deepening
 STARTING_DEPTH = 1
 
@@ -90,11 +217,16 @@ LATE_MOVE_REDUCTION_TABLE = [[int(0.20 * math.log(i) * math.log(j) + 0.7) for j
 MAX_HISTORY_VALUE = 10000
 HISTORY_SHRINK_FACTOR = 2
 
+## Static exchange evaluation
+# Move ordering score for captures that lose material, below every quiet move
+LOSING_CAPTURE_SCORE = -30000
+
 ## Delta Pruning
 DELTA_PRUNING_CUTOFF = 1000
 
 # Killer Move Heuristic
-MAX_KILLER_MOVES = 16
+# Killer moves kept for every ply, a new killer pushes the older one down a slot
+KILLER_SLOTS = 2
 
 ## Positional values ##
 # Ratings for piece positionally in midgame, (first rank is on top)
@@ -160,3 +292,109 @@ PIECE_MOBILITY_TABLES = (
 )
 
 WILL_TO_PUSH = 5
+
+## Game phase ##
+# How much each piece type counts towards the remaining material used for game phase tapering
+GAME_PHASE_WEIGHTS = (0, 1, 10, 10, 20, 40, 0)
+# Remaining material in the starting position, (16 * 1) + (8 * 10) + (4 * 20) + (2 * 40)
+GAME_PHASE_TOTAL = 256
+
+## Incremental evaluation ##
+# Pawns, knights and kings attack the same squares no matter what else is on the board,
+# so their mobility only depends on their square, [phase][piece_type][square]
+STATIC_MOBILITY_ATTACKS = (None, BB_PAWN_ATTACKS[WHITE], BB_KNIGHT_ATTACKS, None, None, None, BB_KING_ATTACKS)
+STATIC_MOBILITY_VALUES = tuple(
+	tuple(
+		tuple(
+			PIECE_MOBILITY_TABLES[piece_type][phase][popcount(STATIC_MOBILITY_ATTACKS[piece_type][square])] if STATIC_MOBILITY_ATTACKS[piece_type] else 0
+			for square in range(64)
+		) if piece_type else None
+		for piece_type in range(KING+1)
+	)
+	for phase in (MIDGAME, ENDGAME)
+)
+
+# Material, position, will to push and static mobility values summed per piece and square so they
+# can be updated incrementally on every move, in whites perspective, [phase][color][piece_type][square]
+PIECE_SQUARE_VALUES = tuple(
+	tuple(
+		(None,) + tuple(
+			tuple(
+				(
+					PHASED_CP_PIECE_VALUES[phase][piece_type] +
+					position_tables[piece_type][square if color == WHITE else square_mirror(square)] +
+					square_rank(square if color == WHITE else square_mirror(square)) * WILL_TO_PUSH +
+					STATIC_MOBILITY_VALUES[phase][piece_type][square if color == WHITE else square_mirror(square)]
+				) * COLOR_MOD[color]
+				for square in range(64)
+			)
+			for piece_type in range(PAWN, KING+1)
+		)
+		for color in (BLACK, WHITE)
+	)
+	for phase, position_tables in ((MIDGAME, MIDGAME_PIECE_POSITION_TABLES), (ENDGAME, ENDGAME_PIECE_POSITION_TABLES))
+)
+
+## Analysis ##
+# Most lines the MultiPV option can ask for
+MAX_MULTI_PV = 64
+
+## Opening book ##
+# How a move is picked from the polyglot book, the heaviest entry or randomly by weight
+BOOK_SELECTIONS = ("best", "weighted")
+
+## Endgame tablebases ##
+# Most pieces syzygy tablebases exist for, the default SyzygyProbeLimit
+MAX_SYZYGY_PIECES = 7
+
+## Bench ##
+# Searched to a fixed depth by the bench command, the total node count is a signature of the search
+BENCH_DEPTH = 4
+# Hash size used for bench, independent of the Hash option so the node count is reproducible
+BENCH_HASH_SIZE = 16
+# Default depth of the perft command
+PERFT_DEPTH = 4
+
+# Openings, middlegames and endgames with lots of different material and pawn structures
+BENCH_POSITIONS = (
+	"rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+	"r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 10",
+	"8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 11",
+	"4rrk1/pp1n3p/3q2pQ/2p1pb2/2PP4/2P3N1/P2B2PP/4RRK1 b - - 7 19",
+	"rq3rk1/ppp2ppp/1bnpb3/3N2B1/3NP3/7P/PPPQ1PP1/2KR3R w - - 7 14",
+	"r1bq1r1k/1pp1n1pp/1p1p4/4p2Q/4Pp2/1BNP4/PPP2PPP/3R1RK1 w - - 2 14",
+	"r3r1k1/2p2ppp/p1p1bn2/8/1q2P3/2NPQN2/PPP3PP/R4RK1 b - - 2 15",
+	"r1bbk1nr/pp3p1p/2n5/1N4p1/2Np1B2/8/PPP2PPP/2KR1B1R w kq - 0 13",
+	"r1bq1rk1/ppp1nppp/4n3/3p3Q/3P4/1BP1B3/PP1N2PP/R4RK1 w - - 1 16",
+	"4r1k1/r1q2ppp/ppp2n2/4P3/5Rb1/1N1BQ3/PPP3PP/R5K1 w - - 1 17",
+	"2rqkb1r/ppp2p2/2npb1p1/1N1Nn2p/2P1PP2/8/PP2B1PP/R1BQK2R b KQ - 0 11",
+	"r1bq1r1k/b1p1npp1/p2p3p/1p6/3PP3/1B2NN2/PP3PPP/R2Q1RK1 w - - 1 16",
+	"3r1rk1/p5pp/bpp1pp2/8/q1PP1P2/b3P3/P2NQRPP/1R2B1K1 b - - 6 22",
+	"r1q2rk1/2p1bppp/2Pp4/p6b/Q1PNp3/4B3/PP1R1PPP/2K4R w - - 2 18",
+	"4k2r/1pb2ppp/1p2p3/1R1p4/3P4/2r1PN2/P4PPP/1R4K1 b - - 3 22",
+	"3q2k1/pb3p1p/4pbp1/2r5/PpN2N2/1P2P2P/5PP1/Q2R2K1 b - - 4 26",
+	"6k1/6p1/6Pp/ppp5/3pn2P/1P3K2/1PP2P2/8 b - - 3 54",
+	"3b4/5kp1/1p1p1p1p/pP1PpP1P/P1P1P3/3KN3/8/8 w - - 0 1",
+	"2K5/p7/7P/5pR1/8/5k2/r7/8 w - - 0 1",
+	"8/6pk/1p6/8/PP3p1p/5P2/4KP1q/3Q4 w - - 0 1",
+	"7k/3p2pp/4q3/8/4Q3/5Kp1/P6b/8 w - - 0 1",
+	"8/2p5/8/2kPKp1p/2p4P/2P5/3P4/8 w - - 0 1",
+	"8/1p3pp1/7p/5P1P/2k3P1/8/2K2P2/8 w - - 0 1",
+	"8/pp2r1k1/2p1p3/3pP2p/1P1P1P1P/P5KR/8/8 w - - 0 1",
+	"8/3p4/p1bk3p/Pp6/1Kp1PpPp/2P2P1P/2P5/5B2 b - - 0 1",
+	"5k2/7R/4P2p/5K2/p1r2P1p/8/8/8 b - - 0 1",
+	"6k1/6p1/P6p/r1N5/5p2/7P/1b3PP1/4R1K1 w - - 0 1",
+	"1r3k2/4q3/2Pp3b/3Bp3/2Q2p2/1p1P2P1/1P2KP2/3N4 w - - 0 1",
+	"6k1/4pp1p/3p2p1/P1pPb3/R7/1r2P1PP/3B1P2/6K1 w - - 0 1",
+	"8/3p3B/5p2/5P2/p7/PP5b/k7/6K1 w - - 0 1",
+	"5rk1/q6p/2p3bR/1pPp1rP1/1P1Pp3/P3B1Q1/1K3P2/R7 w - - 93 90",
+	"4rrk1/1p1nq3/p7/2p1P1pp/3P2bp/3Q1Bn1/PPPB4/1K2R1NR w - - 40 21",
+	"r3k2r/3nnpbp/q2pp1p1/p7/Pp1PPPP1/4BNN1/1P5P/R2Q1RK1 w kq - 0 16",
+	"3Qb1k1/1r2ppb1/pN1n2q1/Pp1Pp1Pr/4P2p/4BP2/4B1R1/1R5K b - - 11 40",
+	"4k3/3q1r2/1N2r1b1/3ppN2/2nPP3/1B1R2n1/2R1Q3/3K4 w - - 5 1",
+	"8/8/8/8/5kp1/P7/8/1K1N4 w - - 0 1",
+	"8/8/8/5N2/8/p7/8/2NK3k w - - 0 1",
+	"8/3k4/8/8/8/4B3/4KB2/1B6 w - - 0 1",
+	"8/8/1P6/5pr1/8/4R3/7k/2K5 w - - 0 1",
+	"8/R7/2q5/8/6k1/8/1P5p/K6R w - - 0 124",
+)
@@ -0,0 +1,182 @@
+"""
+EPD Test Suites
+
+Runs a suite of EPD positions (WAC, STS and the like) through the search in
+parallel, one engine per process with its own transposition table and move
+ordering tables. The move found is checked against the bm (best move) and am
+(avoid move) operations of each position. Results are printed as positions
+finish, followed by the number solved, the average time to solution and the
+combined nodes per second of every process.
+
+The time to solution is when the search settled on a correct move for good,
+the start of the last run of iterations that all had a correct best move.
+
+Usage: python epd.py suite.epd [--movetime MS | --depth N | --nodes N] [--processes N] [--hash MB] [--syzygy PATH]
+"""
+
+import argparse
+import multiprocessing
+import os
+import time
+
+import chess
+
+import qchess
+from const import *
+
+
+# Default time per position when no limit is given
+EPD_MOVETIME = 1000
+
+# Hash size of each process, small since a suite runs many processes for short searches
+EPD_HASH_SIZE = 16
+
+
+def read_suite(path):
+	"""
+	Reads the positions of an EPD file, returns a list of tuples of
+	(id, fen, best moves, avoid moves) with the moves as UCI strings
+	"""
+
+	positions = []
+
+	with open(path) as f:
+		for line_number, line in enumerate(f, 1):
+			line = line.strip()
+			if not line or line.startswith("#"):
+				continue
+
+			try:
+				board, operations = chess.Board.from_epd(line)
+			except ValueError as error:
+				print(f"skipping line {line_number}: {error}")
+				continue
+
+			positions.append((
+				operations.get("id", str(line_number)),
+				board.fen(),
+				[move.uci() for move in operations.get("bm", [])],
+				[move.uci() for move in operations.get("am", [])]
+			))
+
+	return positions
+
+
+def init_worker(movetime, depth, nodes, hash_size, syzygy):
+	# Every process gets its own engine, set up once and reused for each position it's handed
+	qchess.position_table.resize(hash_size)
+	qchess.allowed_depth = depth
+	qchess.allowed_nodes = nodes
+	qchess.time_manager.reset()
+
+	if movetime is not None:
+		qchess.time_manager.set_movetime(movetime)
+
+	if syzygy:
+		qchess.open_tablebase(syzygy)
+
+
+def is_correct(move, best_moves, avoid_moves):
+	return (not best_moves or move in best_moves) and move not in avoid_moves
+
+
+def analyse(task):
+	"""
+	Searches one position of the suite from a fresh game, returns a dict of
+	the result
+	"""
+
+	index, (position_id, fen, best_moves, avoid_moves) = task
+
+	qchess.new_game()
+	board = chess.Board(fen)
+	iterations = []
+
+	bestmove = qchess.iterative_deepening(
+		board,
+		report=False,
+		on_iteration=lambda depth, score, move, elapsed, nodes: iterations.append((depth, move.uci(), elapsed))
+	)
+	elapsed = int((time.time() - qchess.search_start_time) * 1000)
+
+	solved = None
+	solution_time = None
+
+	if best_moves or avoid_moves:
+		solved = is_correct(bestmove.uci(), best_moves, avoid_moves)
+
+		if solved:
+			# Walk back through the iterations for as long as they agree the move is correct
+			solution_time = elapsed
+			for depth, move, iteration_time in reversed(iterations):
+				if not is_correct(move, best_moves, avoid_moves):
+					break
+				solution_time = iteration_time
+
+	return {
+		"index": index,
+		"id": position_id,
+		"move": board.san(bestmove),
+		"expected": " ".join(
+			[f"bm {board.san(chess.Move.from_uci(move))}" for move in best_moves] +
+			[f"am {board.san(chess.Move.from_uci(move))}" for move in avoid_moves]
+		),
+		"solved": solved,
+		"solution_time": solution_time,
+		"depth": iterations[-1][0] if iterations else 0,
+		"nodes": qchess.nodes,
+		"time": elapsed
+	}
+
+
+def run_suite(positions, movetime=None, depth=None, nodes=None, processes=None, hash_size=EPD_HASH_SIZE, syzygy=None):
+	"""
+	Analyses every position across a pool of processes, printing each
+	result as soon as it's in, returns the results in suite order
+	"""
+
+	results = [None] * len(positions)
+	start_time = time.time()
+
+	with multiprocessing.Pool(processes, initializer=init_worker, initargs=(movetime, depth, nodes, hash_size, syzygy)) as pool:
+		for finished, result in enumerate(pool.imap_unordered(analyse, enumerate(positions)), 1):
+			results[result["index"]] = result
+
+			status = {True: "solved", False: "failed", None: "------"}[result["solved"]]
+			solution = f" in {result['solution_time']}ms" if result["solved"] else ""
+			print(f"[{finished}/{len(positions)}] {result['id']}: {status} {result['move']} ({result['expected'] or 'no bm/am'}){solution}, depth {result['depth']} nodes {result['nodes']} time {result['time']}ms")
+
+	elapsed = max(time.time() - start_time, 0.001)
+
+	checked = [result for result in results if result["solved"] is not None]
+	solved = [result for result in checked if result["solved"]]
+	total_nodes = sum(result["nodes"] for result in results)
+
+	print()
+	print(f"solved {len(solved)}/{len(checked)} ({len(solved) * 100 / max(len(checked), 1):.1f}%)")
+	if solved:
+		print(f"average time to solution {sum(result['solution_time'] for result in solved) // len(solved)}ms")
+	print(f"{len(results)} positions, {total_nodes} nodes in {elapsed:.2f}s, {int(total_nodes / elapsed)} nps over {processes or os.cpu_count()} processes")
+
+	return results
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Run an EPD test suite in parallel")
+	parser.add_argument("suite", help="EPD file with bm and/or am operations")
+	limit = parser.add_mutually_exclusive_group()
+	limit.add_argument("--movetime", type=int, help=f"time per position in milliseconds (default {EPD_MOVETIME})")
+	limit.add_argument("--depth", type=int, help="depth per position")
+	limit.add_argument("--nodes", type=int, help="nodes per position")
+	parser.add_argument("--processes", type=int, help="processes to search with (default one per cpu)")
+	parser.add_argument("--hash", type=int, default=EPD_HASH_SIZE, help="hash size of each process in MB")
+	parser.add_argument("--syzygy", help="syzygy tablebase directories")
+
+	args = parser.parse_args()
+
+	if args.movetime is None and args.depth is None and args.nodes is None:
+		args.movetime = EPD_MOVETIME
+
+	run_suite(read_suite(args.suite), args.movetime, args.depth, args.nodes, args.processes, args.hash, args.syzygy)
+
+	qchess.position_table.close()
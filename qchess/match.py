@@ -0,0 +1,391 @@
+"""
+Match Runner
+
+Plays two UCI engines against each other to find out whether a change made
+the engine stronger. Every opening is played twice with colors reversed, and
+games run concurrently, each worker keeping its own pair of engine processes
+for all of its games. Games are adjudicated once both engines agree the
+result is clear, every finished game is written to a PGN file, and after
+every game the score, an Elo estimate and the log likelihood ratio of a
+sequential probability ratio test (SPRT) are printed. The match stops by
+itself as soon as the SPRT accepts or rejects that the first engine is at
+least elo1 stronger than the second, rather than elo0.
+
+Usage:
+	python match.py --first "python qchess.py" --second "python ../../old/qchess/qchess.py" [--tc 10+0.1 | --movetime MS | --nodes N]
+		[--first-option NAME=VALUE ...] [--second-option NAME=VALUE ...] [--openings FILE] [--games N] [--concurrency N]
+		[--elo0 0] [--elo1 5] [--alpha 0.05] [--beta 0.05] [--pgn match.pgn]
+"""
+
+import argparse
+import concurrent.futures
+import math
+import os
+import shlex
+import threading
+import time
+
+import chess
+import chess.engine
+import chess.pgn
+
+
+# Played when no opening file is given, each of them twice with colors reversed
+MATCH_OPENINGS = (
+	"e2e4 e7e5 g1f3 b8c6 f1b5",
+	"e2e4 e7e5 g1f3 b8c6 f1c4",
+	"e2e4 c7c5 g1f3 d7d6 d2d4",
+	"e2e4 c7c5 b1c3 b8c6 g2g3",
+	"e2e4 e7e6 d2d4 d7d5 b1c3",
+	"e2e4 c7c6 d2d4 d7d5 e4e5",
+	"e2e4 d7d5 e4d5 d8d5 b1c3",
+	"d2d4 d7d5 c2c4 e7e6 b1c3",
+	"d2d4 d7d5 c2c4 c7c6 g1f3",
+	"d2d4 g8f6 c2c4 e7e6 b1c3",
+	"d2d4 g8f6 c2c4 g7g6 b1c3",
+	"d2d4 f7f5 g2g3 g8f6 f1g2",
+	"c2c4 e7e5 b1c3 g8f6 g2g3",
+	"g1f3 d7d5 g2g3 g8f6 f1g2",
+	"c2c4 c7c5 g1f3 b8c6 b1c3",
+	"e2e4 g7g6 d2d4 f8g7 b1c3",
+)
+
+# Both engines have to agree on a score beyond this, for this many moves each, to adjudicate a win
+ADJUDICATE_WIN_SCORE = 1000
+ADJUDICATE_WIN_MOVES = 4
+
+# And within this for this many moves each, after the given move number, to adjudicate a draw
+ADJUDICATE_DRAW_SCORE = 10
+ADJUDICATE_DRAW_MOVES = 8
+ADJUDICATE_DRAW_START = 40
+
+# Games still going after this many moves are drawn
+MAX_GAME_MOVES = 300
+
+RESULTS = {"1-0": 1, "0-1": 0, "1/2-1/2": 0.5}
+
+
+def parse_options(pairs):
+	# NAME=VALUE pairs from the command line into a dict of UCI options
+	options = {}
+
+	for pair in pairs or []:
+		name, _, value = pair.partition("=")
+		options[name] = value
+
+	return options
+
+
+def read_openings(path):
+	"""
+	Reads an opening file, one FEN/EPD or line of UCI moves from the
+	starting position per line, returns a list of boards
+	"""
+
+	openings = []
+
+	for line in (open(path) if path else MATCH_OPENINGS):
+		line = line.strip()
+		if not line or line.startswith("#"):
+			continue
+
+		if "/" in line:
+			board = chess.Board.from_epd(line)[0] if len(line.split()) < 6 or ";" in line else chess.Board(line)
+		else:
+			board = chess.Board()
+			for move in line.split():
+				board.push_uci(move)
+
+		openings.append(board)
+
+	return openings
+
+
+def sprt(wins, draws, losses, elo0, elo1):
+	"""
+	Log likelihood ratio of the first engine being elo1 rather than elo0
+	stronger, from the normal approximation of the game results
+	"""
+
+	games = wins + draws + losses
+	if not games:
+		return 0.0
+
+	score = (wins + draws / 2) / games
+	variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+
+	# Nothing can be said while every game had the same result
+	if not variance:
+		return 0.0
+
+	score0 = 1 / (1 + 10 ** (-elo0 / 400))
+	score1 = 1 / (1 + 10 ** (-elo1 / 400))
+
+	return games * (score1 - score0) * (2 * score - score0 - score1) / (2 * variance)
+
+
+def elo_estimate(wins, draws, losses):
+	# Elo difference of the first engine along with a 95% error margin
+	games = wins + draws + losses
+	score = (wins + draws / 2) / games
+	stdev = math.sqrt((wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games / games)
+
+	def elo(score):
+		score = min(max(score, 1e-6), 1 - 1e-6)
+		return -400 * math.log10(1 / score - 1)
+
+	return elo(score), (elo(score + 1.96 * stdev) - elo(score - 1.96 * stdev)) / 2
+
+
+class Match:
+	"""
+	Match
+
+	Keeps the settings of a match and hands out a pair of engines to every
+	worker thread. Each engine is a process of its own, so the games really
+	do run in parallel even though the workers are threads.
+	"""
+
+	def __init__(self, commands, options, limit, clock, names):
+		self.commands = commands
+		self.options = options
+		self.limit = limit
+		self.clock = clock
+		self.names = names
+		self.local = threading.local()
+		self.engines = []
+		self.lock = threading.Lock()
+		self.stopped = threading.Event()
+
+	def open_engine(self, side):
+		engine = chess.engine.SimpleEngine.popen_uci(shlex.split(self.commands[side]))
+
+		for name in self.options[side]:
+			if name not in engine.options:
+				print(f"{self.names[side]} has no option {name}")
+
+		engine.configure({name: value for name, value in self.options[side].items() if name in engine.options})
+
+		with self.lock:
+			self.engines.append(engine)
+
+		return engine
+
+	def get_engines(self):
+		if not hasattr(self.local, "engines"):
+			self.local.engines = [self.open_engine(0), self.open_engine(1)]
+		return self.local.engines
+
+	def replace_engine(self, side):
+		# After a crash the engine has to be started again for the next game
+		try:
+			self.local.engines[side].quit()
+		except (chess.engine.EngineError, chess.engine.EngineTerminatedError, TimeoutError):
+			pass
+		self.local.engines[side] = self.open_engine(side)
+
+	def close(self):
+		for engine in self.engines:
+			try:
+				engine.quit()
+			except (chess.engine.EngineError, chess.engine.EngineTerminatedError, TimeoutError):
+				pass
+
+	def play_game(self, index, opening, first_white):
+		"""
+		Plays one game from the opening, returns a tuple of the game index,
+		the score of the first engine and the PGN of the game, or None if the
+		match was stopped first
+		"""
+
+		if self.stopped.is_set():
+			return None
+
+		engines = self.get_engines()
+		board = opening.copy()
+		sides = {chess.WHITE: 0 if first_white else 1, chess.BLACK: 1 if first_white else 0}
+
+		# Scores from whites perspective, last few of each side
+		scores = []
+		result = None
+		termination = None
+
+		if self.clock is not None:
+			clocks = {chess.WHITE: self.clock[0], chess.BLACK: self.clock[0]}
+
+		while result is None:
+			if self.stopped.is_set():
+				return None
+
+			outcome = board.outcome(claim_draw=True)
+			if outcome is not None:
+				result = outcome.result()
+				termination = outcome.termination.name.lower().replace("_", " ")
+				break
+
+			if board.fullmove_number - opening.fullmove_number >= MAX_GAME_MOVES:
+				result, termination = "1/2-1/2", "adjudication, move limit"
+				break
+
+			side = sides[board.turn]
+			limit = self.limit
+
+			if self.clock is not None:
+				limit = chess.engine.Limit(
+					white_clock=clocks[chess.WHITE], black_clock=clocks[chess.BLACK],
+					white_inc=self.clock[1], black_inc=self.clock[1]
+				)
+
+			start_time = time.time()
+
+			try:
+				played = engines[side].play(board, limit, info=chess.engine.INFO_SCORE, game=(index, id(engines[side])))
+			except (chess.engine.EngineError, chess.engine.EngineTerminatedError):
+				self.replace_engine(side)
+				result, termination = ("0-1" if board.turn == chess.WHITE else "1-0"), "engine crashed"
+				break
+
+			if self.clock is not None:
+				clocks[board.turn] -= time.time() - start_time
+				if clocks[board.turn] < 0:
+					result, termination = ("0-1" if board.turn == chess.WHITE else "1-0"), "time forfeit"
+					break
+				clocks[board.turn] += self.clock[1]
+
+			if played.move is None or not board.is_legal(played.move):
+				result, termination = ("0-1" if board.turn == chess.WHITE else "1-0"), "illegal move"
+				break
+
+			score = played.info.get("score")
+			scores.append(score.white().score(mate_score=100000) if score is not None else None)
+			board.push(played.move)
+
+			result, termination = self.adjudicate(board, scores)
+
+		game = chess.pgn.Game.from_board(board)
+		game.headers["Event"] = "match"
+		game.headers["Round"] = str(index + 1)
+		game.headers["White"] = self.names[sides[chess.WHITE]]
+		game.headers["Black"] = self.names[sides[chess.BLACK]]
+		game.headers["Result"] = result
+		game.headers["Termination"] = termination
+
+		score = RESULTS[result] if first_white else 1 - RESULTS[result]
+
+		return index, score, game
+
+	def adjudicate(self, board, scores):
+		# Returns the (result, termination) once the engines agree the game is decided, or (None, None)
+		recent = scores[-ADJUDICATE_WIN_MOVES * 2:]
+		if len(recent) == ADJUDICATE_WIN_MOVES * 2 and None not in recent:
+			if all(score >= ADJUDICATE_WIN_SCORE for score in recent):
+				return "1-0", "adjudication, win"
+			if all(score <= -ADJUDICATE_WIN_SCORE for score in recent):
+				return "0-1", "adjudication, win"
+
+		recent = scores[-ADJUDICATE_DRAW_MOVES * 2:]
+		if board.fullmove_number >= ADJUDICATE_DRAW_START and len(recent) == ADJUDICATE_DRAW_MOVES * 2 and None not in recent:
+			if all(abs(score) <= ADJUDICATE_DRAW_SCORE for score in recent):
+				return "1/2-1/2", "adjudication, draw"
+
+		return None, None
+
+
+def run_match(match, openings, games, concurrency, elo0, elo1, alpha, beta, pgn_path):
+	"""
+	Plays the match, printing the running score after every game until
+	either the SPRT reaches a bound or all games are played, returns a
+	tuple of (wins, draws, losses) of the first engine
+	"""
+
+	lower_bound = math.log(beta / (1 - alpha))
+	upper_bound = math.log((1 - beta) / alpha)
+
+	wins = draws = losses = 0
+	finished = 0
+
+	with open(pgn_path, "a") if pgn_path else open(os.devnull, "w") as pgn, concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+		futures = [
+			pool.submit(match.play_game, i, openings[(i // 2) % len(openings)], i % 2 == 0)
+			for i in range(games)
+		]
+
+		for future in concurrent.futures.as_completed(futures):
+			game_result = future.result()
+			if game_result is None:
+				continue
+
+			index, score, game = game_result
+			finished += 1
+
+			if score == 1:
+				wins += 1
+			elif score == 0:
+				losses += 1
+			else:
+				draws += 1
+
+			print(game, file=pgn, end="\n\n", flush=True)
+
+			elo, margin = elo_estimate(wins, draws, losses)
+			llr = sprt(wins, draws, losses, elo0, elo1)
+
+			print(
+				f"game {finished}/{games} ({game.headers['White']} vs {game.headers['Black']} {game.headers['Result']}, {game.headers['Termination']}) "
+				f"score {wins}-{losses}-{draws} elo {elo:+.1f} +/- {margin:.1f} llr {llr:.2f} ({lower_bound:.2f}, {upper_bound:.2f})"
+			)
+
+			if llr >= upper_bound or llr <= lower_bound:
+				print(f"sprt {'accepted' if llr >= upper_bound else 'rejected'} elo1 {elo1} over elo0 {elo0} after {finished} games")
+				match.stopped.set()
+				for pending in futures:
+					pending.cancel()
+				break
+
+	return wins, draws, losses
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Play a match between two UCI engines with an SPRT")
+	parser.add_argument("--first", required=True, help="command running the engine being tested")
+	parser.add_argument("--second", required=True, help="command running the engine to compare against")
+	parser.add_argument("--first-option", action="append", metavar="NAME=VALUE", help="UCI option of the first engine, can be repeated")
+	parser.add_argument("--second-option", action="append", metavar="NAME=VALUE", help="UCI option of the second engine, can be repeated")
+	parser.add_argument("--first-name", help="name of the first engine in the PGN")
+	parser.add_argument("--second-name", help="name of the second engine in the PGN")
+	limit = parser.add_mutually_exclusive_group()
+	limit.add_argument("--tc", default="10+0.1", help="time control in seconds per game + increment (default 10+0.1)")
+	limit.add_argument("--movetime", type=int, help="milliseconds per move instead of a clock")
+	limit.add_argument("--nodes", type=int, help="nodes per move instead of a clock")
+	parser.add_argument("--openings", help="file of FEN/EPD lines or UCI move lines to start games from")
+	parser.add_argument("--games", type=int, default=1000, help="most games to play, stops early once the SPRT is decided")
+	parser.add_argument("--concurrency", type=int, default=os.cpu_count(), help="games played at once")
+	parser.add_argument("--elo0", type=float, default=0)
+	parser.add_argument("--elo1", type=float, default=5)
+	parser.add_argument("--alpha", type=float, default=0.05)
+	parser.add_argument("--beta", type=float, default=0.05)
+	parser.add_argument("--pgn", default="match.pgn", help="file the games are appended to")
+
+	args = parser.parse_args()
+
+	if args.movetime is not None:
+		limit, clock = chess.engine.Limit(time=args.movetime / 1000), None
+	elif args.nodes is not None:
+		limit, clock = chess.engine.Limit(nodes=args.nodes), None
+	else:
+		base, _, increment = args.tc.partition("+")
+		limit, clock = None, (float(base), float(increment or 0))
+
+	match = Match(
+		(args.first, args.second),
+		(parse_options(args.first_option), parse_options(args.second_option)),
+		limit,
+		clock,
+		(args.first_name or "first", args.second_name or "second")
+	)
+
+	try:
+		run_match(match, read_openings(args.openings), args.games, args.concurrency, args.elo0, args.elo1, args.alpha, args.beta, args.pgn)
+	finally:
+		match.stopped.set()
+		match.close()
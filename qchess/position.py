@@ -0,0 +1,703 @@
+import chess
+import chess.polyglot
+from chess import (
+	WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING,
+	BB_KNIGHT_ATTACKS, BB_KING_ATTACKS, BB_PAWN_ATTACKS,
+	BB_DIAG_ATTACKS, BB_DIAG_MASKS, BB_RANK_ATTACKS, BB_RANK_MASKS, BB_FILE_ATTACKS, BB_FILE_MASKS,
+	BB_RANK_1, BB_RANK_2, BB_RANK_3, BB_RANK_6, BB_RANK_7, BB_RANK_8, BB_DARK_SQUARES, BB_LIGHT_SQUARES
+)
+
+from const import *
+
+
+# Castling rights as bits, white kingside, white queenside, black kingside, black queenside
+CASTLE_WHITE_KING = 1
+CASTLE_WHITE_QUEEN = 2
+CASTLE_BLACK_KING = 4
+CASTLE_BLACK_QUEEN = 8
+
+# Castling rights left after a move touches a square, kings and rooks moving or rooks being captured
+CASTLING_MASKS = [15] * 64
+CASTLING_MASKS[chess.E1] = 15 & ~(CASTLE_WHITE_KING | CASTLE_WHITE_QUEEN)
+CASTLING_MASKS[chess.H1] = 15 & ~CASTLE_WHITE_KING
+CASTLING_MASKS[chess.A1] = 15 & ~CASTLE_WHITE_QUEEN
+CASTLING_MASKS[chess.E8] = 15 & ~(CASTLE_BLACK_KING | CASTLE_BLACK_QUEEN)
+CASTLING_MASKS[chess.H8] = 15 & ~CASTLE_BLACK_KING
+CASTLING_MASKS[chess.A8] = 15 & ~CASTLE_BLACK_QUEEN
+
+# Polyglot keys for every combination of castling rights
+CASTLING_ZOBRIST = [0] * 16
+for rights in range(16):
+	for bit, (corner, key) in zip((CASTLE_WHITE_KING, CASTLE_WHITE_QUEEN, CASTLE_BLACK_KING, CASTLE_BLACK_QUEEN), ZOBRIST_CASTLING_KEYS):
+		if rights & bit:
+			CASTLING_ZOBRIST[rights] ^= key
+
+# [color] of (right, king from, king to, rook from, rook to, squares that must be empty, squares the king passes through)
+CASTLING_MOVES = (
+	(
+		(CASTLE_BLACK_KING, chess.E8, chess.G8, chess.H8, chess.F8, chess.BB_F8 | chess.BB_G8, (chess.E8, chess.F8)),
+		(CASTLE_BLACK_QUEEN, chess.E8, chess.C8, chess.A8, chess.D8, chess.BB_B8 | chess.BB_C8 | chess.BB_D8, (chess.E8, chess.D8))
+	),
+	(
+		(CASTLE_WHITE_KING, chess.E1, chess.G1, chess.H1, chess.F1, chess.BB_F1 | chess.BB_G1, (chess.E1, chess.F1)),
+		(CASTLE_WHITE_QUEEN, chess.E1, chess.C1, chess.A1, chess.D1, chess.BB_B1 | chess.BB_C1 | chess.BB_D1, (chess.E1, chess.D1))
+	)
+)
+
+PROMOTION_TYPES = (QUEEN, ROOK, BISHOP, KNIGHT)
+
+
+class Position:
+	"""
+	Position
+
+	The board the search runs on, made of plain int bitboards and a list of
+	the piece on every square. Moves are ints packed the same way as in the
+	transposition table, from (6) | to (6) | promotion (3). Moves are
+	generated pseudo-legally and only checked for legality when they're made,
+	so only the moves actually searched pay for it. Making a move updates the
+	polyglot zobrist hash along with the parts of the evaluation which only
+	depend on where pieces stand (material, piece square tables and will to
+	push, for both midgame and endgame), the remaining material used for game
+	phase tapering and a zobrist key of only the pawns for the pawn structure
+	cache, so none of them ever have to rescan the board. Unmaking a move
+	restores everything from the history stack. Only standard chess is
+	supported, python-chess boards are only used at the UCI boundary.
+	"""
+
+	__slots__ = (
+		"pieces", "occupied_co", "occupied", "squares", "turn", "castling", "ep_square",
+		"halfmove_clock", "fullmove_number", "zobrist_hash", "mg", "eg", "remaining", "pawn_key", "history"
+	)
+
+	# Check every incremental hash against a full polyglot hash, also toggled by the UCI debug command
+	verify_zobrist = DEBUG_ZOBRIST
+
+	def __init__(self, board=None):
+		self.set_board(chess.Board() if board is None else board)
+
+	def set_board(self, board):
+		"""
+		Loads the position of a python-chess board, the moves that led to it
+		are played out from the starting position so repetitions of positions
+		from before the search can be found
+		"""
+
+		self.load_board(board.root() if board.move_stack else board)
+
+		for move in board.move_stack:
+			self.make(move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12))
+
+	def load_board(self, board):
+		# Load only the position of a python-chess board, without its move history
+		self.pieces = [[0] * (KING+1), [0] * (KING+1)]
+		self.occupied_co = [0, 0]
+		self.occupied = 0
+		self.squares = [0] * 64
+		self.turn = board.turn
+		self.halfmove_clock = board.halfmove_clock
+		self.fullmove_number = board.fullmove_number
+		self.history = []
+
+		self.castling = 0
+		for bit, corner in ((CASTLE_WHITE_KING, chess.BB_H1), (CASTLE_WHITE_QUEEN, chess.BB_A1), (CASTLE_BLACK_KING, chess.BB_H8), (CASTLE_BLACK_QUEEN, chess.BB_A8)):
+			if board.castling_rights & corner:
+				self.castling |= bit
+
+		self.zobrist_hash = CASTLING_ZOBRIST[self.castling] ^ (ZOBRIST_TURN_KEY if self.turn == WHITE else 0)
+		self.mg = 0
+		self.eg = 0
+		self.remaining = 0
+		self.pawn_key = 0
+
+		for square, piece in board.piece_map().items():
+			self.put_piece(piece.color, piece.piece_type, square)
+
+		# The en passant square is only kept if a pawn can capture there, the same as polyglot hashes it
+		self.ep_square = None
+		if board.ep_square is not None and BB_PAWN_ATTACKS[not self.turn][board.ep_square] & self.pieces[self.turn][PAWN]:
+			self.ep_square = board.ep_square
+			self.zobrist_hash ^= ZOBRIST_EP_KEYS[board.ep_square & 7]
+
+	def put_piece(self, color, piece_type, square):
+		bb = 1 << square
+		self.pieces[color][piece_type] |= bb
+		self.occupied_co[color] |= bb
+		self.occupied |= bb
+		self.squares[square] = piece_type | (color << 3)
+
+		self.zobrist_hash ^= ZOBRIST_PIECE_KEYS[color][piece_type][square]
+		self.mg += PIECE_SQUARE_VALUES[MIDGAME][color][piece_type][square]
+		self.eg += PIECE_SQUARE_VALUES[ENDGAME][color][piece_type][square]
+		self.remaining += GAME_PHASE_WEIGHTS[piece_type]
+		if piece_type == PAWN:
+			self.pawn_key ^= ZOBRIST_PIECE_KEYS[color][PAWN][square]
+
+	def board(self):
+		# A python-chess board of the current position, without move history
+		board = chess.Board(None)
+
+		for square, code in enumerate(self.squares):
+			if code:
+				board.set_piece_at(square, chess.Piece(code & 7, bool(code >> 3)))
+
+		board.turn = self.turn
+		board.castling_rights = 0
+		for bit, corner in ((CASTLE_WHITE_KING, chess.BB_H1), (CASTLE_WHITE_QUEEN, chess.BB_A1), (CASTLE_BLACK_KING, chess.BB_H8), (CASTLE_BLACK_QUEEN, chess.BB_A8)):
+			if self.castling & bit:
+				board.castling_rights |= corner
+
+		board.ep_square = self.ep_square
+		board.halfmove_clock = self.halfmove_clock
+		board.fullmove_number = self.fullmove_number
+
+		return board
+
+	def is_attacked(self, square, color):
+		# Whether any piece of color attacks the square
+		pieces = self.pieces[color]
+		occupied = self.occupied
+
+		return bool(
+			(BB_KNIGHT_ATTACKS[square] & pieces[KNIGHT]) or
+			(BB_PAWN_ATTACKS[not color][square] & pieces[PAWN]) or
+			(BB_KING_ATTACKS[square] & pieces[KING]) or
+			(BB_DIAG_ATTACKS[square][BB_DIAG_MASKS[square] & occupied] & (pieces[BISHOP] | pieces[QUEEN])) or
+			((BB_RANK_ATTACKS[square][BB_RANK_MASKS[square] & occupied] | BB_FILE_ATTACKS[square][BB_FILE_MASKS[square] & occupied]) & (pieces[ROOK] | pieces[QUEEN]))
+		)
+
+	def is_check(self):
+		return self.is_attacked(self.pieces[self.turn][KING].bit_length() - 1, not self.turn)
+
+	def is_repetition(self, count=3):
+		"""
+		A position can only repeat since the last capture or pawn move, and
+		only with the same side to move, so only every other hash on the
+		history stack back to there is compared
+		"""
+
+		zobrist_hash = self.zobrist_hash
+		history = self.history
+		seen = 1
+
+		for i in range(len(history) - 2, max(len(history) - self.halfmove_clock, 0) - 1, -2):
+			if history[i][5] == zobrist_hash:
+				seen += 1
+				if seen >= count:
+					return True
+
+		return False
+
+	def is_fifty_moves(self):
+		# Claimable under the fifty move rule, without generating moves to check for mate like python-chess
+		return self.halfmove_clock >= 100
+
+	def has_insufficient_material(self, color):
+		# The same rules as python-chess, whether color can't possibly checkmate
+		pieces = self.pieces
+		ours = self.occupied_co[color]
+
+		if ours & (pieces[WHITE][PAWN] | pieces[BLACK][PAWN] | pieces[WHITE][ROOK] | pieces[BLACK][ROOK] | pieces[WHITE][QUEEN] | pieces[BLACK][QUEEN]):
+			return False
+
+		knights = pieces[WHITE][KNIGHT] | pieces[BLACK][KNIGHT]
+		bishops = pieces[WHITE][BISHOP] | pieces[BLACK][BISHOP]
+
+		# A knight can only mate with the help of anything but a queen on the other side
+		if ours & knights:
+			return chess.popcount(ours) <= 2 and not (self.occupied_co[not color] & ~(pieces[WHITE][KING] | pieces[BLACK][KING] | pieces[WHITE][QUEEN] | pieces[BLACK][QUEEN]))
+
+		# Bishops can only mate if there are bishops on both colors or there's a knight to block with
+		if ours & bishops:
+			same_color = not (bishops & BB_DARK_SQUARES) or not (bishops & BB_LIGHT_SQUARES)
+			return same_color and not (pieces[WHITE][PAWN] | pieces[BLACK][PAWN]) and not knights
+
+		return True
+
+	def is_insufficient_material(self):
+		return self.has_insufficient_material(WHITE) and self.has_insufficient_material(BLACK)
+
+	def has_legal_move(self):
+		for move in self.generate_moves():
+			if self.make(move):
+				self.unmake()
+				return True
+
+		return False
+
+	def is_stalemate(self):
+		return not self.is_check() and not self.has_legal_move()
+
+	def is_capture(self, move):
+		to_square = (move >> 6) & 63
+		return bool(self.squares[to_square]) or (to_square == self.ep_square and self.squares[move & 63] & 7 == PAWN)
+
+	def is_pseudo_legal(self, move):
+		"""
+		Whether a move that comes from another position, like a killer or the
+		best move from the transposition table, can be played here. Legality
+		is only checked once it's made, like for generated moves.
+		"""
+
+		from_square = move & 63
+		to_square = (move >> 6) & 63
+		promotion = move >> 12
+
+		turn = self.turn
+		code = self.squares[from_square]
+		to_bb = 1 << to_square
+
+		if not code or (code >> 3) != turn or self.occupied_co[turn] & to_bb:
+			return False
+
+		piece_type = code & 7
+		occupied = self.occupied
+
+		if piece_type == PAWN:
+			# Pawns have to promote on the last rank and only there
+			if bool(promotion) != bool(to_bb & (BB_RANK_8 if turn == WHITE else BB_RANK_1)) or (promotion and promotion not in PROMOTION_TYPES):
+				return False
+
+			forward = 8 if turn == WHITE else -8
+
+			if to_square == from_square + forward:
+				return not occupied & to_bb
+
+			if to_square == from_square + forward * 2:
+				return bool((1 << from_square) & (BB_RANK_2 if turn == WHITE else BB_RANK_7)) and not occupied & (to_bb | (1 << (from_square + forward)))
+
+			capturable = self.occupied_co[not turn] | ((1 << self.ep_square) if self.ep_square is not None else 0)
+			return bool(BB_PAWN_ATTACKS[turn][from_square] & to_bb & capturable)
+
+		if promotion:
+			return False
+
+		if piece_type == KNIGHT:
+			return bool(BB_KNIGHT_ATTACKS[from_square] & to_bb)
+
+		if piece_type == KING:
+			if BB_KING_ATTACKS[from_square] & to_bb:
+				return True
+
+			for right, king_from, king_to, rook_from, rook_to, between, passing in CASTLING_MOVES[turn]:
+				if from_square == king_from and to_square == king_to:
+					return bool(self.castling & right) and not occupied & between and not any(self.is_attacked(square, not turn) for square in passing)
+
+			return False
+
+		attacks = 0
+
+		if piece_type != ROOK:
+			attacks |= BB_DIAG_ATTACKS[from_square][BB_DIAG_MASKS[from_square] & occupied]
+
+		if piece_type != BISHOP:
+			attacks |= BB_RANK_ATTACKS[from_square][BB_RANK_MASKS[from_square] & occupied] | BB_FILE_ATTACKS[from_square][BB_FILE_MASKS[from_square] & occupied]
+
+		return bool(attacks & to_bb)
+
+	def gives_check(self, move):
+		"""
+		Whether a move checks the opponent, directly or by uncovering a
+		sliding piece, worked out from the bitboards without making the move
+		"""
+
+		from_square = move & 63
+		to_square = (move >> 6) & 63
+		promotion = move >> 12
+
+		turn = self.turn
+		pieces = self.pieces[turn]
+		king = self.pieces[not turn][KING].bit_length() - 1
+		king_bb = 1 << king
+		piece_type = self.squares[from_square] & 7
+
+		from_bb = 1 << from_square
+		to_bb = 1 << to_square
+		occupied = (self.occupied & ~from_bb) | to_bb
+		diagonal_sliders = (pieces[BISHOP] | pieces[QUEEN]) & ~from_bb
+		straight_sliders = (pieces[ROOK] | pieces[QUEEN]) & ~from_bb
+
+		if piece_type == PAWN and to_square == self.ep_square:
+			# The pawn taken en passant can uncover a check as well
+			occupied &= ~(1 << (to_square - 8 if turn == WHITE else to_square + 8))
+
+		elif piece_type == KING and abs(to_square - from_square) == 2:
+			# Castling can only check with the rook
+			rook_from, rook_to = (from_square + 3, from_square + 1) if to_square > from_square else (from_square - 4, from_square - 1)
+			occupied = (occupied & ~(1 << rook_from)) | (1 << rook_to)
+			straight_sliders = (straight_sliders & ~(1 << rook_from)) | (1 << rook_to)
+
+		piece_type = promotion or piece_type
+
+		if piece_type == PAWN:
+			if BB_PAWN_ATTACKS[turn][to_square] & king_bb:
+				return True
+		elif piece_type == KNIGHT:
+			if BB_KNIGHT_ATTACKS[to_square] & king_bb:
+				return True
+		else:
+			if piece_type in (BISHOP, QUEEN):
+				diagonal_sliders |= to_bb
+			if piece_type in (ROOK, QUEEN):
+				straight_sliders |= to_bb
+
+		return bool(
+			(BB_DIAG_ATTACKS[king][BB_DIAG_MASKS[king] & occupied] & diagonal_sliders) or
+			((BB_RANK_ATTACKS[king][BB_RANK_MASKS[king] & occupied] | BB_FILE_ATTACKS[king][BB_FILE_MASKS[king] & occupied]) & straight_sliders)
+		)
+
+	def generate_moves(self, quiet=True, tactical=True):
+		"""
+		Pseudo-legal moves of the side to move as a list of ints, moves that
+		leave our king in check are only found out when they're made. Tactical
+		moves are captures and promotions, quiet moves are all of the others,
+		so the search can generate them in separate stages.
+		"""
+
+		moves = []
+		append = moves.append
+
+		turn = self.turn
+		pieces = self.pieces[turn]
+		theirs = self.occupied_co[not turn]
+		occupied = self.occupied
+		targets = (theirs if tactical else 0) | ((~occupied & chess.BB_ALL) if quiet else 0)
+
+		# Knights
+		bb = pieces[KNIGHT]
+		while bb:
+			from_square = (bb & -bb).bit_length() - 1
+			bb &= bb - 1
+			attacks = BB_KNIGHT_ATTACKS[from_square] & targets
+			while attacks:
+				to_square = (attacks & -attacks).bit_length() - 1
+				attacks &= attacks - 1
+				append(from_square | (to_square << 6))
+
+		# Bishops and queens along diagonals
+		bb = pieces[BISHOP] | pieces[QUEEN]
+		while bb:
+			from_square = (bb & -bb).bit_length() - 1
+			bb &= bb - 1
+			attacks = BB_DIAG_ATTACKS[from_square][BB_DIAG_MASKS[from_square] & occupied] & targets
+			while attacks:
+				to_square = (attacks & -attacks).bit_length() - 1
+				attacks &= attacks - 1
+				append(from_square | (to_square << 6))
+
+		# Rooks and queens along ranks and files
+		bb = pieces[ROOK] | pieces[QUEEN]
+		while bb:
+			from_square = (bb & -bb).bit_length() - 1
+			bb &= bb - 1
+			attacks = (BB_RANK_ATTACKS[from_square][BB_RANK_MASKS[from_square] & occupied] | BB_FILE_ATTACKS[from_square][BB_FILE_MASKS[from_square] & occupied]) & targets
+			while attacks:
+				to_square = (attacks & -attacks).bit_length() - 1
+				attacks &= attacks - 1
+				append(from_square | (to_square << 6))
+
+		# King
+		king = pieces[KING].bit_length() - 1
+		attacks = BB_KING_ATTACKS[king] & targets
+		while attacks:
+			to_square = (attacks & -attacks).bit_length() - 1
+			attacks &= attacks - 1
+			append(king | (to_square << 6))
+
+		# Castling, the square the king lands on is checked when the move is made like any other
+		if self.castling and quiet:
+			for right, king_from, king_to, rook_from, rook_to, between, passing in CASTLING_MOVES[turn]:
+				if self.castling & right and not occupied & between and not any(self.is_attacked(square, not turn) for square in passing):
+					append(king_from | (king_to << 6))
+
+		# Pawns
+		pawns = pieces[PAWN]
+		empty = ~occupied & chess.BB_ALL
+
+		if turn == WHITE:
+			single = (pawns << 8) & empty
+			double = ((single & BB_RANK_3) << 8) & empty
+			forward = 8
+			last_rank = BB_RANK_8
+		else:
+			single = (pawns >> 8) & empty
+			double = ((single & BB_RANK_6) >> 8) & empty
+			forward = -8
+			last_rank = BB_RANK_1
+
+		capturable = theirs
+		if self.ep_square is not None:
+			capturable |= 1 << self.ep_square
+
+		# Captures, which can promote as well, are tactical, pushes only if they promote
+		if not tactical:
+			capturable = 0
+			single &= ~last_rank
+		elif not quiet:
+			single &= last_rank
+			double = 0
+
+		bb = pawns if capturable else 0
+		while bb:
+			from_square = (bb & -bb).bit_length() - 1
+			bb &= bb - 1
+			attacks = BB_PAWN_ATTACKS[turn][from_square] & capturable
+			while attacks:
+				to_square = (attacks & -attacks).bit_length() - 1
+				attacks &= attacks - 1
+				if (1 << to_square) & last_rank:
+					for promotion in PROMOTION_TYPES:
+						append(from_square | (to_square << 6) | (promotion << 12))
+				else:
+					append(from_square | (to_square << 6))
+
+		while single:
+			to_square = (single & -single).bit_length() - 1
+			single &= single - 1
+			if (1 << to_square) & last_rank:
+				for promotion in PROMOTION_TYPES:
+					append((to_square - forward) | (to_square << 6) | (promotion << 12))
+			else:
+				append((to_square - forward) | (to_square << 6))
+
+		while double:
+			to_square = (double & -double).bit_length() - 1
+			double &= double - 1
+			append((to_square - forward * 2) | (to_square << 6))
+
+		return moves
+
+	def make(self, move):
+		"""
+		Plays a move, returns False and takes it back again if it left our
+		king in check
+		"""
+
+		from_square = move & 63
+		to_square = (move >> 6) & 63
+		promotion = move >> 12
+
+		turn = self.turn
+		them = not turn
+		squares = self.squares
+		pieces = self.pieces[turn]
+		their_pieces = self.pieces[them]
+		piece_type = squares[from_square] & 7
+		captured = squares[to_square]
+		capture_square = to_square
+
+		mg_values = PIECE_SQUARE_VALUES[MIDGAME][turn]
+		eg_values = PIECE_SQUARE_VALUES[ENDGAME][turn]
+		keys = ZOBRIST_PIECE_KEYS[turn]
+
+		mg = self.mg
+		eg = self.eg
+		remaining = self.remaining
+		pawn_key = self.pawn_key
+		zobrist_hash = self.zobrist_hash ^ ZOBRIST_TURN_KEY
+
+		if self.ep_square is not None:
+			zobrist_hash ^= ZOBRIST_EP_KEYS[self.ep_square & 7]
+
+		if piece_type == PAWN and to_square == self.ep_square:
+			# En passant, the captured pawn is behind the target square
+			capture_square = to_square - 8 if turn == WHITE else to_square + 8
+			captured = squares[capture_square]
+
+		self.history.append((move, captured, capture_square, self.castling, self.ep_square, self.zobrist_hash, self.halfmove_clock, mg, eg, remaining, pawn_key))
+
+		# Lift the moving piece off of its square
+		from_bb = 1 << from_square
+		pieces[piece_type] ^= from_bb
+		self.occupied_co[turn] ^= from_bb
+		squares[from_square] = 0
+		mg -= mg_values[piece_type][from_square]
+		eg -= eg_values[piece_type][from_square]
+		zobrist_hash ^= keys[piece_type][from_square]
+
+		if piece_type == PAWN:
+			pawn_key ^= keys[PAWN][from_square]
+
+		if captured:
+			captured_type = captured & 7
+			capture_bb = 1 << capture_square
+			their_pieces[captured_type] ^= capture_bb
+			self.occupied_co[them] ^= capture_bb
+			squares[capture_square] = 0
+
+			# The opponents tables are already negated for them, so subtracting removes their piece
+			mg -= PIECE_SQUARE_VALUES[MIDGAME][them][captured_type][capture_square]
+			eg -= PIECE_SQUARE_VALUES[ENDGAME][them][captured_type][capture_square]
+			remaining -= GAME_PHASE_WEIGHTS[captured_type]
+			zobrist_hash ^= ZOBRIST_PIECE_KEYS[them][captured_type][capture_square]
+
+			if captured_type == PAWN:
+				pawn_key ^= ZOBRIST_PIECE_KEYS[them][PAWN][capture_square]
+
+		if promotion:
+			remaining += GAME_PHASE_WEIGHTS[promotion] - GAME_PHASE_WEIGHTS[PAWN]
+			piece_type = promotion
+
+		# Put the (possibly promoted) piece down on its new square
+		to_bb = 1 << to_square
+		pieces[piece_type] |= to_bb
+		self.occupied_co[turn] |= to_bb
+		squares[to_square] = piece_type | (turn << 3)
+		mg += mg_values[piece_type][to_square]
+		eg += eg_values[piece_type][to_square]
+		zobrist_hash ^= keys[piece_type][to_square]
+
+		if piece_type == PAWN:
+			pawn_key ^= keys[PAWN][to_square]
+
+		if piece_type == KING and abs(to_square - from_square) == 2:
+			# Castling, the rook jumps over the king
+			rook_from, rook_to = (from_square + 3, from_square + 1) if to_square > from_square else (from_square - 4, from_square - 1)
+			rook_bb = (1 << rook_from) | (1 << rook_to)
+			pieces[ROOK] ^= rook_bb
+			self.occupied_co[turn] ^= rook_bb
+			squares[rook_to] = squares[rook_from]
+			squares[rook_from] = 0
+			mg += mg_values[ROOK][rook_to] - mg_values[ROOK][rook_from]
+			eg += eg_values[ROOK][rook_to] - eg_values[ROOK][rook_from]
+			zobrist_hash ^= keys[ROOK][rook_to] ^ keys[ROOK][rook_from]
+
+		self.occupied = self.occupied_co[WHITE] | self.occupied_co[BLACK]
+
+		if self.castling:
+			castling = self.castling & CASTLING_MASKS[from_square] & CASTLING_MASKS[to_square]
+			zobrist_hash ^= CASTLING_ZOBRIST[self.castling] ^ CASTLING_ZOBRIST[castling]
+			self.castling = castling
+
+		# A double pawn push only leaves an en passant square if an enemy pawn could take it
+		self.ep_square = None
+		if piece_type == PAWN and abs(to_square - from_square) == 16:
+			ep_square = (from_square + to_square) >> 1
+			if BB_PAWN_ATTACKS[turn][ep_square] & their_pieces[PAWN]:
+				self.ep_square = ep_square
+				zobrist_hash ^= ZOBRIST_EP_KEYS[ep_square & 7]
+
+		self.halfmove_clock = 0 if piece_type == PAWN or promotion or captured else self.halfmove_clock + 1
+		if turn == BLACK:
+			self.fullmove_number += 1
+
+		self.turn = them
+		self.mg = mg
+		self.eg = eg
+		self.remaining = remaining
+		self.pawn_key = pawn_key
+		self.zobrist_hash = zobrist_hash
+
+		if self.is_attacked(pieces[KING].bit_length() - 1, them):
+			self.unmake()
+			return False
+
+		if self.verify_zobrist:
+			assert zobrist_hash == chess.polyglot.zobrist_hash(self.board()), f"zobrist hash mismatch after {chess.Move(from_square, to_square, promotion or None)} in {self.board().fen()}"
+
+		return True
+
+	def make_null(self):
+		# Passes the move to the opponent, for null move pruning
+		self.history.append((0, 0, 0, self.castling, self.ep_square, self.zobrist_hash, self.halfmove_clock, self.mg, self.eg, self.remaining, self.pawn_key))
+
+		self.zobrist_hash ^= ZOBRIST_TURN_KEY
+		if self.ep_square is not None:
+			self.zobrist_hash ^= ZOBRIST_EP_KEYS[self.ep_square & 7]
+			self.ep_square = None
+
+		self.halfmove_clock += 1
+		if self.turn == BLACK:
+			self.fullmove_number += 1
+
+		self.turn = not self.turn
+
+	def unmake(self):
+		move, captured, capture_square, self.castling, self.ep_square, self.zobrist_hash, self.halfmove_clock, self.mg, self.eg, self.remaining, self.pawn_key = self.history.pop()
+
+		from_square = move & 63
+		to_square = (move >> 6) & 63
+		promotion = move >> 12
+
+		them = self.turn
+		turn = not them
+		self.turn = turn
+
+		if turn == BLACK:
+			self.fullmove_number -= 1
+
+		# Null moves don't touch the board
+		if not move:
+			return
+
+		squares = self.squares
+		pieces = self.pieces[turn]
+		piece_type = squares[to_square] & 7
+
+		# Take the piece back to where it came from, as a pawn again if it promoted
+		to_bb = 1 << to_square
+		from_bb = 1 << from_square
+		pieces[piece_type] ^= to_bb
+		self.occupied_co[turn] ^= to_bb | from_bb
+		squares[to_square] = 0
+
+		if promotion:
+			piece_type = PAWN
+
+		pieces[piece_type] |= from_bb
+		squares[from_square] = piece_type | (turn << 3)
+
+		if captured:
+			capture_bb = 1 << capture_square
+			self.pieces[them][captured & 7] |= capture_bb
+			self.occupied_co[them] |= capture_bb
+			squares[capture_square] = captured
+
+		elif piece_type == KING and abs(to_square - from_square) == 2:
+			rook_from, rook_to = (from_square + 3, from_square + 1) if to_square > from_square else (from_square - 4, from_square - 1)
+			rook_bb = (1 << rook_from) | (1 << rook_to)
+			pieces[ROOK] ^= rook_bb
+			self.occupied_co[turn] ^= rook_bb
+			squares[rook_from] = squares[rook_to]
+			squares[rook_to] = 0
+
+		self.occupied = self.occupied_co[WHITE] | self.occupied_co[BLACK]
+
+	def legal_moves(self):
+		# Only for when every legal move is needed at once, the search makes pseudo-legal moves and checks the result
+		moves = []
+		for move in self.generate_moves():
+			if self.make(move):
+				self.unmake()
+				moves.append(move)
+		return moves
+
+	def perft(self, depth):
+		# Counts the leaf nodes of the legal move tree to the given depth
+		if depth == 0:
+			return 1
+
+		count = 0
+		for move in self.generate_moves():
+			if self.make(move):
+				count += self.perft(depth - 1) if depth > 1 else 1
+				self.unmake()
+
+		return count
+
+
+def chess_perft(board, depth):
+	# Reference perft using python-chess, to validate the position class against
+	if depth == 0:
+		return 1
+
+	count = 0
+	for move in board.legal_moves:
+		if depth == 1:
+			count += 1
+		else:
+			board.push(move)
+			count += chess_perft(board, depth - 1)
+			board.pop()
+
+	return count
@@ -1,5 +1,173 @@
-from qchess import *
+"""
+Profiler
 
+Profiles the search over the bench positions, each searched from a fresh game
+under a node or time budget, and prints the functions sorted by where the time
+went. A snapshot of the per function stats can be saved as JSON, and two
+snapshots diffed to show which functions got slower between builds. Only uses
+cProfile, so it works the same under CPython and PyPy.
+
+Usage:
+	python profiler.py run [--nodes N | --movetime MS] [--positions N] [--sort cumulative|tottime] [--top N] [--output FILE]
+	python profiler.py diff OLD NEW [--top N]
+"""
+
+import argparse
 import cProfile
+import json
+import platform
+import pstats
+import time
+
+import chess
+
+import qchess
+from const import *
+
+
+# Default budget per position, nodes are reproducible, time isn't
+PROFILE_NODES = 5000
+
+
+def profile_suite(nodes=None, movetime=None, positions=len(BENCH_POSITIONS)):
+	"""
+	Searches the first positions of the bench suite under the budget with
+	the profiler running, returns the pstats.Stats along with the total
+	node count and time spent
+	"""
+
+	qchess.allowed_nodes = nodes
+	qchess.time_manager.reset()
+	if movetime is not None:
+		qchess.time_manager.set_movetime(movetime)
+	qchess.allowed_depth = None
+
+	# Extra lines and tablebase probes would make runs incomparable, like in bench
+	qchess.multi_pv = 1
+	qchess.tablebase = None
+
+	profiler = cProfile.Profile()
+	total_nodes = 0
+	start_time = time.time()
+
+	for fen in BENCH_POSITIONS[:positions]:
+		qchess.new_game()
+		board = chess.Board(fen)
+
+		profiler.enable()
+		qchess.iterative_deepening(board, report=False)
+		profiler.disable()
+
+		total_nodes += qchess.nodes
+
+	return pstats.Stats(profiler), total_nodes, time.time() - start_time
+
+
+def function_name(func):
+	# Line numbers are left out so functions still match up after the code around them changes
+	file_name, _, name = func
+	return f"{'/'.join(file_name.replace(chr(92), '/').split('/')[-2:])}({name})"
+
+
+def snapshot(stats, total_nodes, elapsed, budget):
+	# Everything needed to compare two runs, functions with the same name in a file are added together
+	functions = {}
+
+	for func, (_, calls, tottime, cumtime, _) in stats.stats.items():
+		entry = functions.setdefault(function_name(func), {"calls": 0, "tottime": 0, "cumtime": 0})
+		entry["calls"] += calls
+		entry["tottime"] += tottime
+		entry["cumtime"] += cumtime
+
+	return {
+		"python": f"{platform.python_implementation()} {platform.python_version()}",
+		"version": VERSION,
+		"budget": budget,
+		"nodes": total_nodes,
+		"time": elapsed,
+		"functions": functions
+	}
+
+
+def diff(old, new, top):
+	"""
+	Compares two snapshots function by function. Times are scaled to
+	microseconds per node searched so runs with different node counts
+	(a time budget, or search changes) can still be compared.
+	"""
+
+	old_nodes = max(old["nodes"], 1)
+	new_nodes = max(new["nodes"], 1)
+
+	print(f"old: {old['python']} {old['nodes']} nodes in {old['time']:.2f}s ({old['nodes'] / old['time']:.0f} nps)")
+	print(f"new: {new['python']} {new['nodes']} nodes in {new['time']:.2f}s ({new['nodes'] / new['time']:.0f} nps)")
+	print()
+
+	rows = []
+
+	for name in set(old["functions"]) | set(new["functions"]):
+		old_stats = old["functions"].get(name, {"calls": 0, "tottime": 0, "cumtime": 0})
+		new_stats = new["functions"].get(name, {"calls": 0, "tottime": 0, "cumtime": 0})
+
+		old_tottime = old_stats["tottime"] * 1e6 / old_nodes
+		new_tottime = new_stats["tottime"] * 1e6 / new_nodes
+		old_cumtime = old_stats["cumtime"] * 1e6 / old_nodes
+		new_cumtime = new_stats["cumtime"] * 1e6 / new_nodes
+
+		rows.append((new_tottime - old_tottime, old_tottime, new_tottime, new_cumtime - old_cumtime, old_stats["calls"] / old_nodes, new_stats["calls"] / new_nodes, name))
+
+	# Slowest changes first
+	rows.sort(reverse=True)
+
+	print(f"{'tottime us/node':>28} {'cumtime us/node':>16} {'calls/node':>20}")
+	print(f"{'delta':>9} {'old':>8} {'new':>8} {'delta':>16} {'old':>9} {'new':>9}  function")
+
+	for tottime_delta, old_tottime, new_tottime, cumtime_delta, old_calls, new_calls, name in rows[:top]:
+		print(f"{tottime_delta:>+9.2f} {old_tottime:>8.2f} {new_tottime:>8.2f} {cumtime_delta:>+16.2f} {old_calls:>9.3f} {new_calls:>9.3f}  {name}")
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Profile the search over the bench positions")
+	commands = parser.add_subparsers(dest="command", required=True)
+
+	run_parser = commands.add_parser("run", help="profile the search and print a report")
+	budget = run_parser.add_mutually_exclusive_group()
+	budget.add_argument("--nodes", type=int, help=f"node budget per position (default {PROFILE_NODES})")
+	budget.add_argument("--movetime", type=int, help="time budget per position in milliseconds")
+	run_parser.add_argument("--positions", type=int, default=len(BENCH_POSITIONS), help="how many of the bench positions to search")
+	run_parser.add_argument("--sort", default="cumulative", choices=("cumulative", "tottime", "calls"), help="report sort order")
+	run_parser.add_argument("--top", type=int, default=40, help="functions to show in the report")
+	run_parser.add_argument("--output", help="save a JSON snapshot to this file")
+
+	diff_parser = commands.add_parser("diff", help="compare two snapshots")
+	diff_parser.add_argument("old")
+	diff_parser.add_argument("new")
+	diff_parser.add_argument("--top", type=int, default=40, help="functions to show")
+
+	args = parser.parse_args()
+
+	if args.command == "run":
+		if args.nodes is None and args.movetime is None:
+			args.nodes = PROFILE_NODES
+
+		stats, total_nodes, elapsed = profile_suite(args.nodes, args.movetime, args.positions)
+
+		print(f"{platform.python_implementation()} {platform.python_version()}, {args.positions} positions, {total_nodes} nodes in {elapsed:.2f}s")
+		stats.sort_stats(args.sort).print_stats(args.top)
+
+		if args.output:
+			budget = {"nodes": args.nodes} if args.nodes is not None else {"movetime": args.movetime}
+			budget["positions"] = args.positions
+
+			with open(args.output, "w") as f:
+				json.dump(snapshot(stats, total_nodes, elapsed, budget), f, indent=1)
+
+	elif args.command == "diff":
+		with open(args.old) as f:
+			old = json.load(f)
+		with open(args.new) as f:
+			new = json.load(f)
+
+		diff(old, new, args.top)
 
-cProfile.run("iterative_deepening(board)")
+	qchess.position_table.close()
@@ -1,18 +1,40 @@
 import chess
-from chess import WHITE, BLACK, KING, PAWN, BISHOP, KNIGHT, ROOK, QUEEN, Termination
+from chess import WHITE, BLACK, KING, PAWN, BISHOP, ROOK, QUEEN
 import chess.polyglot
+import chess.syzygy
+import asyncio
+from array import array
 import functools
+import json
 import math
+import os
+import multiprocessing
+import queue
+import sys
 import threading
 import time
 
+from position import Position, chess_perft
+from ttable import TranspositionTable, PawnTable, EvalTable
+from timeman import TimeManager
 from const import *
 from util import *
 
 print = functools.partial(print, flush=True) # used to fix stdout for UCI
 
+# Set up by the UCI front end, lines from every thread are queued there and written out in order by a single writer
+output_queue = None
+output_loop = None
 
-def score_move(board, move, level, phase, pt_best_move = None):
+def send(line):
+	# Sends a line to the GUI, until the UCI front end is running it's simply printed
+	if output_loop is None:
+		print(line)
+	else:
+		output_loop.call_soon_threadsafe(output_queue.put_nowait, line)
+
+
+def score_move(position, move, level, phase, pt_best_move = None):
 	"""
 	Used to score individual moves for move ordering, essentially
 	a guess at how likely any given move is to be the correct move
@@ -23,55 +45,109 @@ def score_move(board, move, level, phase, pt_best_move = None):
 		return 90000
 
 	# Promotions, we like to look at them first since they're momentuous moves
-	if move.promotion == QUEEN:
+	if move >> 12 == QUEEN:
 		return 80000
 
-	victim = board.piece_at(move.to_square)
-	attacker = board.piece_at(move.from_square)
+	if position.squares[(move >> 6) & 0x3F]:
+		return score_capture(position, move)
+
+	# Killers and countermoves are kept as moves encoded the same way
+	killer_index = level * KILLER_SLOTS
+
+	if move == killer_moves[killer_index]:
+		return 60000
 
-	if victim is not None:
-		# MVV LVA, we prefer to take the most valuable victim with the least valuable attacker
-		return 70000 + CP_PIECE_VALUES[victim.piece_type] - CP_PIECE_VALUES[attacker.piece_type]
+	if move == killer_moves[killer_index+1]:
+		return 59999
 
-	if move in killer_moves[level]:
-		return 60000 - killer_moves[level].index(move)
+	history = position.history
 
-	if len(board.move_stack) >= 2 and move == countermove_table[board.move_stack[-2].from_square][board.move_stack[-2].to_square]:
-		return 50000
+	if len(history) >= 2:
+		if move == countermove_table[history[-2][0] & 0xFFF]:
+			return 50000
 
-	if len(board.move_stack) and move.to_square == board.move_stack[-1].to_square:
+	if len(history) and (move >> 6) & 0x3F == (history[-1][0] >> 6) & 0x3F:
 		# a simple, but quite efficient heuristic is capturing the last moved piece
 		return 40000
 
 	# Oftentimes if a check is available it will be done, so look at checks earlier
-	if board.gives_check(move):
+	if position.gives_check(move):
 		return 30000
 
-	score = history_table[board.turn][move.from_square][move.to_square]
+	return score_quiet_move(position, move, phase)
+
+
+def score_capture(position, move):
+	"""
+	Scores captures and promotions, winning captures are searched first,
+	then even trades, and captures that lose material come after every
+	quiet move
+	"""
+
+	promotion = move >> 12
+
+	# Promotions, we like to look at them first since they're momentuous moves
+	if promotion == QUEEN:
+		return 80000
+
+	if promotion:
+		# Underpromotions are very rarely any good
+		return 0
+
+	# En passant captures land on an empty square
+	victim = (position.squares[(move >> 6) & 0x3F] & 7) or PAWN
+	attacker = position.squares[move & 0x3F] & 7
+
+	# MVV LVA, we prefer to take the most valuable victim with the least valuable attacker
+	mvv_lva = CP_PIECE_VALUES[victim] - CP_PIECE_VALUES[attacker]
+
+	# Only captures with a more valuable attacker than victim need a static exchange evaluation to tell if they lose material
+	exchange = mvv_lva if mvv_lva > 0 else see(position, move)
+
+	if exchange > 0:
+		return 75000 + mvv_lva
+	elif exchange == 0:
+		return 70000 + mvv_lva
+
+	return LOSING_CAPTURE_SCORE + exchange
+
+
+def score_quiet_move(position, move, phase):
+	"""
+	Scores passive moves by the history heuristic and how
+	much the moved piece improves its position
+	"""
+
+	from_square = move & 0x3F
+	to_square = (move >> 6) & 0x3F
+	piece_type = position.squares[from_square] & 7
+	turn = position.turn
+
+	score = history_table[(turn << 12) | (move & 0xFFF)]
 
 	# Remaining passive moves
 
-	if attacker.piece_type == KING:
+	if piece_type == KING:
 		# generally avoid moving king
 		score -= CP_PIECE_VALUES[PAWN]
 	
 	# Change in positional scoring, we would prefer to move from a bad spot to a good spot than a good spot to a bad spot
 	score -= lerp(
-		MIDGAME_PIECE_POSITION_TABLES[attacker.piece_type][move.from_square if board.turn else chess.square_mirror(move.from_square)],
-		ENDGAME_PIECE_POSITION_TABLES[attacker.piece_type][move.from_square if board.turn else chess.square_mirror(move.from_square)],
+		MIDGAME_PIECE_POSITION_TABLES[piece_type][from_square if turn else chess.square_mirror(from_square)],
+		ENDGAME_PIECE_POSITION_TABLES[piece_type][from_square if turn else chess.square_mirror(from_square)],
 		phase
 	)
 
 	score += lerp(
-		MIDGAME_PIECE_POSITION_TABLES[attacker.piece_type][move.to_square if board.turn else chess.square_mirror(move.to_square)],
-		ENDGAME_PIECE_POSITION_TABLES[attacker.piece_type][move.to_square if board.turn else chess.square_mirror(move.to_square)],
+		MIDGAME_PIECE_POSITION_TABLES[piece_type][to_square if turn else chess.square_mirror(to_square)],
+		ENDGAME_PIECE_POSITION_TABLES[piece_type][to_square if turn else chess.square_mirror(to_square)],
 		phase
 	)
 	
 	return score
 
 
-def sorted_moves(moves, board, level, pt_best_move = None):
+def sorted_moves(moves, position, level, pt_best_move = None):
 	"""
 	Move Ordering
 
@@ -84,97 +160,237 @@ def sorted_moves(moves, board, level, pt_best_move = None):
 	at face value to the top to be searched first.
 	"""
 	
-	phase = game_phase(board)
-	moves.sort(key=lambda move: score_move(board, move, level, phase, pt_best_move), reverse=True)
+	phase = game_phase(position)
+	moves.sort(key=lambda move: score_move(position, move, level, phase, pt_best_move), reverse=True)
 	return moves
 
 
-def game_phase(board): # returns a float from 0-1 representing game phase
-	remaining = 0
-	remaining += len(board.pieces(PAWN, BLACK) | board.pieces(PAWN, WHITE))
-	remaining += len(board.pieces(KNIGHT, BLACK) | board.pieces(KNIGHT, WHITE)) * 10
-	remaining += len(board.pieces(BISHOP, BLACK) | board.pieces(BISHOP, WHITE)) * 10
-	remaining += len(board.pieces(ROOK, BLACK) | board.pieces(ROOK, WHITE)) * 20
-	remaining += len(board.pieces(QUEEN, BLACK) | board.pieces(QUEEN, WHITE)) * 40
+def staged_moves(position, level, pt_best_move = None):
+	"""
+	Staged Move Generation
+
+	Most nodes cut off on the first or second move we search, so rather
+	than generating, scoring and sorting every move up front like
+	sorted_moves, we hand out moves one stage at a time and only generate
+	and score a stage once every move from the stages before it failed to
+	cut off. In order the stages are the best move from the transposition
+	table, winning and even captures and promotions, killer moves, the
+	countermove, the remaining quiet moves sorted by history and finally
+	captures which lose material. Moves are handed out as tuples of (move,
+	whether it's a capture that loses material) so the static exchange
+	evaluation done for ordering can be reused for pruning. Like the moves
+	the position generates they're only pseudo-legal, the search finds out
+	which leave the king in check when it makes them.
+	"""
+
+	searched = set()
+
+	# The best move from the transposition table doesn't need any move generation at all
+	if pt_best_move is not None and position.is_pseudo_legal(pt_best_move):
+		searched.add(pt_best_move)
+		yield pt_best_move, position.is_capture(pt_best_move) and score_capture(position, pt_best_move) < LOSING_CAPTURE_SCORE
+
+	# Captures and promotions
+	tactical_moves = [
+		(score_capture(position, move), move) for move in position.generate_moves(quiet=False)
+		if move not in searched
+	]
+	tactical_moves.sort(key=lambda scored: scored[0], reverse=True)
+
+	losing_captures = []
+
+	for score, move in tactical_moves:
+		searched.add(move)
+
+		if score <= 0:
+			# Losing captures and underpromotions wait until after the quiet moves
+			losing_captures.append((move, score < LOSING_CAPTURE_SCORE))
+		else:
+			yield move, False
+
+	# Killer moves and the countermove come from other positions, so make sure they are quiet moves we can play here
+	refutations = [killer_moves[level * KILLER_SLOTS], killer_moves[level * KILLER_SLOTS + 1]]
+
+	if len(position.history) >= 2:
+		refutations.append(countermove_table[position.history[-2][0] & 0xFFF])
+
+	for move in refutations:
+		if move and move not in searched and not move >> 12 and position.is_pseudo_legal(move) and not position.is_capture(move):
+			searched.add(move)
+			yield move, False
+
+	# Remaining quiet moves
+	phase = game_phase(position)
+
+	quiet_moves = [
+		move for move in position.generate_moves(tactical=False)
+		if move not in searched
+	]
+	quiet_moves.sort(key=lambda move: score_quiet_move(position, move, phase), reverse=True)
+
+	for move in quiet_moves:
+		yield move, False
+
+	yield from losing_captures
+
 
-	return max(0, min(1, (256-remaining)/256))
+def game_phase(position): # returns a float from 0-1 representing game phase
+	remaining = position.remaining
 
+	return max(0, min(1, (GAME_PHASE_TOTAL-remaining)/GAME_PHASE_TOTAL))
 
-def score_board(board):
+
+def score_pawn_structure(white_pawns, black_pawns):
 	"""
-	Board Evaluation
+	Pawn Structure Evaluation
 
-	Used to give a best guess of the value of a board at face value without
-	doing any tree searches or looking ahead. Simply looking at the board,
-	used to evaluate leaf nodes in a tree search. It will miss anything tactical
-	but should be able to recognize basic positional advantage and material values.
+	Scores doubled, tripled and isolated pawns, passed pawns and pawn chains
+	for both sides using only the pawn bitboards, returns a tuple of
+	(midgame score, endgame score) in whites perspective
 	"""
-	
-	if board.can_claim_threefold_repetition() or board.can_claim_fifty_moves() or board.is_insufficient_material() or board.is_stalemate():
+
+	mg = 0
+	eg = 0
+
+	# Squares where enemy pawns could stop or capture a pawn on its way to promotion
+	white_blockers = south_fill(black_pawns >> 8)
+	white_blockers |= adjacent_files(white_blockers)
+	black_blockers = north_fill(white_pawns << 8)
+	black_blockers |= adjacent_files(black_blockers)
+
+	for color, pawns, blockers, defenders in (
+		(WHITE, white_pawns, white_blockers, ((white_pawns & ~chess.BB_FILE_A) << 7) | ((white_pawns & ~chess.BB_FILE_H) << 9)),
+		(BLACK, black_pawns, black_blockers, ((black_pawns & ~chess.BB_FILE_A) >> 9) | ((black_pawns & ~chess.BB_FILE_H) >> 7))
+	):
+		color_mod = COLOR_MOD[color]
+
+		# Pawns with one or two more pawns of the same color behind them on their file
+		stacked = pawns & south_fill(pawns >> 8)
+		tripled_files = file_set(stacked & south_fill(stacked >> 8))
+		doubled_files = file_set(stacked) & ~tripled_files
+
+		doubled = chess.popcount(doubled_files)
+		tripled = chess.popcount(tripled_files)
+		mg += (DOUBLED_PAWN_PENALTY[MIDGAME] * doubled + TRIPLED_PAWN_PENALTY[MIDGAME] * tripled) * color_mod
+		eg += (DOUBLED_PAWN_PENALTY[ENDGAME] * doubled + TRIPLED_PAWN_PENALTY[ENDGAME] * tripled) * color_mod
+
+		# Files with pawns but no pawns on either neighbouring file
+		files = file_set(pawns)
+		isolated = chess.popcount(files & ~adjacent_files(files))
+		mg += ISOLATED_PAWN_PENALTY[MIDGAME] * isolated * color_mod
+		eg += ISOLATED_PAWN_PENALTY[ENDGAME] * isolated * color_mod
+
+		# Pawns defended by another pawn
+		chained = chess.popcount(pawns & defenders)
+		mg += PAWN_CHAIN_BONUS[MIDGAME] * chained * color_mod
+		eg += PAWN_CHAIN_BONUS[ENDGAME] * chained * color_mod
+
+		# Passed pawns, there are rarely more than a couple so we can afford to look at each one
+		for square in chess.scan_forward(pawns & ~blockers):
+			rank = chess.square_rank(square) if color == WHITE else 7 - chess.square_rank(square)
+			mg += PASSED_PAWN_BONUS[MIDGAME][rank] * color_mod
+			eg += PASSED_PAWN_BONUS[ENDGAME][rank] * color_mod
+
+	return mg, eg
+
+
+def score_board(position):
+	"""
+	Board Score
+
+	The score of a position from the perspective of the player to move, draws
+	that depend on how we got here are checked first, everything else is
+	the static evaluation of the position which is cached by zobrist key
+	"""
+
+	stats[STAT_EVALS] += 1
+
+	if position.is_repetition() or position.is_fifty_moves():
 		# Board is drawn
 		return 0
 
-	score = 0
+	zobrist_hash = position.zobrist_hash
+	score = eval_table.probe(zobrist_hash)
 
-	# Check if we are in endgame using the amount of pieces on the board
-	phase = game_phase(board)
+	if score is None:
+		score = evaluate_board(position)
+		eval_table.store(zobrist_hash, score)
 
-	pawn_file_counts = ([0, 0, 0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0, 0, 0]) # [turn][file]
+	return score
 
-	for square in range(64): # Iterate through all pieces on the board
-		# Positional piece values, mirror the positional piece values vertically if the piece is black
-		piece_type = board.piece_type_at(square)
 
-		if piece_type is not None:
-			piece_color = board.color_at(square)
-			color_mod = COLOR_MOD[piece_color]
+def evaluate_board(position):
+	"""
+	Board Evaluation
 
-			pov_square = square if piece_color == WHITE else chess.square_mirror(square)
+	Used to give a best guess of the value of a board at face value without
+	doing any tree searches or looking ahead. Simply looking at the board,
+	used to evaluate leaf nodes in a tree search. It will miss anything tactical
+	but should be able to recognize basic positional advantage and material values.
 
-			score += lerp(
-				MIDGAME_PIECE_POSITION_TABLES[piece_type][pov_square],
-				ENDGAME_PIECE_POSITION_TABLES[piece_type][pov_square],
-				phase
-			) * color_mod
+	Material, piece positions, will to push and the mobility of pieces that aren't
+	blocked by others are kept up to date incrementally by the position on every move,
+	the remaining terms are computed here straight from the bitboards.
+	"""
+	
+	if position.is_insufficient_material() or position.is_stalemate():
+		# Board is drawn no matter how we got here
+		return 0
 
-			score += chess.square_rank(pov_square) * WILL_TO_PUSH * color_mod
+	# Check if we are in endgame using the amount of pieces on the board
+	phase = game_phase(position)
+
+	# Incrementally updated midgame and endgame sums, tapered by game phase
+	mg = position.mg
+	eg = position.eg
+
+	occupied = position.occupied
+
+	for color in (WHITE, BLACK):
+		color_mod = COLOR_MOD[color]
+		pieces = position.pieces[color]
+
+		# Mobility of sliding pieces, which depends on what's blocking them
+		for square in chess.scan_forward(pieces[BISHOP] | pieces[QUEEN]):
+			num_attacks = chess.popcount(chess.BB_DIAG_ATTACKS[square][chess.BB_DIAG_MASKS[square] & occupied])
+			if pieces[QUEEN] & chess.BB_SQUARES[square]:
+				num_attacks += chess.popcount(
+					chess.BB_RANK_ATTACKS[square][chess.BB_RANK_MASKS[square] & occupied] |
+					chess.BB_FILE_ATTACKS[square][chess.BB_FILE_MASKS[square] & occupied]
+				)
+				piece_type = QUEEN
+			else:
+				piece_type = BISHOP
 
-			# Piece values, add centipawn values for our pieces, subtract them for opponents pieces
-			score += lerp(PHASED_CP_PIECE_VALUES[MIDGAME][piece_type], PHASED_CP_PIECE_VALUES[ENDGAME][piece_type], phase) * color_mod
+			mg += PIECE_MOBILITY_TABLES[piece_type][MIDGAME][num_attacks] * color_mod
+			eg += PIECE_MOBILITY_TABLES[piece_type][ENDGAME][num_attacks] * color_mod
 
-			if piece_type == PAWN:
-				pawn_file_counts[piece_color][chess.square_file(square)] += 1
+		for square in chess.scan_forward(pieces[ROOK]):
+			num_attacks = chess.popcount(
+				chess.BB_RANK_ATTACKS[square][chess.BB_RANK_MASKS[square] & occupied] |
+				chess.BB_FILE_ATTACKS[square][chess.BB_FILE_MASKS[square] & occupied]
+			)
+			mg += PIECE_MOBILITY_TABLES[ROOK][MIDGAME][num_attacks] * color_mod
+			eg += PIECE_MOBILITY_TABLES[ROOK][ENDGAME][num_attacks] * color_mod
 
-			num_attacks = len(board.attacks(square))
-			score += lerp(
-				PIECE_MOBILITY_TABLES[piece_type][MIDGAME][num_attacks], # midgame
-				PIECE_MOBILITY_TABLES[piece_type][ENDGAME][num_attacks], # endgame
-				phase
-			) * color_mod
+		# Reward having both bishops
+		if chess.popcount(pieces[BISHOP]) >= 2:
+			mg += DOUBLE_BISHOP_BONUS[MIDGAME] * color_mod
+			eg += DOUBLE_BISHOP_BONUS[ENDGAME] * color_mod
 
-	# Reward having both bishops
-	dbb = lerp(DOUBLE_BISHOP_BONUS[MIDGAME], DOUBLE_BISHOP_BONUS[ENDGAME], phase)
-	score += (dbb if len(board.pieces(BISHOP, WHITE)) == 2 else 0) - (dbb if len(board.pieces(BISHOP, BLACK)) == 2 else 0)
+	# Pawn structure rarely changes, so it's cached by the zobrist key of only the pawns
+	pawn_score = pawn_table.probe(position.pawn_key)
 
-	# pawn structure basics
-	for i in range(8):
-		# doubled / tripled pawn penalties
-		dpp = lerp(DOUBLED_PAWN_PENALTY[MIDGAME], DOUBLED_PAWN_PENALTY[ENDGAME], phase)
-		tpp = lerp(DOUBLED_PAWN_PENALTY[MIDGAME], DOUBLED_PAWN_PENALTY[ENDGAME], phase)
-		ipp = lerp(ISOLATED_PAWN_PENALTY[MIDGAME], ISOLATED_PAWN_PENALTY[ENDGAME], phase)
+	if pawn_score is None:
+		pawn_score = score_pawn_structure(position.pieces[WHITE][PAWN], position.pieces[BLACK][PAWN])
+		pawn_table.store(position.pawn_key, *pawn_score)
 
-		score += (dpp if pawn_file_counts[WHITE][i] == 2 else 0) - (dpp if pawn_file_counts[BLACK][i] == 2 else 0)
-		score += (tpp if pawn_file_counts[WHITE][i] > 2 else 0) - (tpp if pawn_file_counts[BLACK][i] > 2 else 0)
+	pawn_mg, pawn_eg = pawn_score
 
-		# isolated pawn penalties
-		if pawn_file_counts[WHITE][i] > 0 and (i == 0 or pawn_file_counts[WHITE][i-1] == 0) and (i == 7 or pawn_file_counts[WHITE][i+1] == 0):
-			score += ipp
-		
-		if pawn_file_counts[BLACK][i] > 0 and (i == 0 or pawn_file_counts[BLACK][i-1] == 0) and (i == 7 or pawn_file_counts[BLACK][i+1] == 0):
-			score -= ipp
+	score = lerp(mg + pawn_mg, eg + pawn_eg, phase)
 
 	# We want the score in the current players perspective for negamax to work
-	score *= COLOR_MOD[board.turn]
+	score *= COLOR_MOD[position.turn]
 
 	score += lerp(TEMPO_BONUS[MIDGAME], TEMPO_BONUS[ENDGAME], phase) # small bonus for player to move
 
@@ -187,17 +403,78 @@ def score_board(board):
 nodes = 0
 search_start_time = 0
 
-# Positional transposition table, dict of {zobrist_hash : flag, leaf_distance, value, board, best_move}
-position_table = {}
+# Counters of what the search spent its nodes on, indexed by the STAT_ enums
+stats = [0] * len(STAT_NAMES)
+
+# Report stats with info strings after every search, and append them as JSON lines to a file
+stats_enabled = False
+stats_file = None
+
+# Positional transposition table, fixed size table of {zobrist_hash : flag, leaf_distance, value, best_move}
+position_table = TranspositionTable()
+
+# Pawn structure cache, fixed size table of {pawn_zobrist_hash : midgame score, endgame score}
+pawn_table = PawnTable()
+
+# Static evaluation cache, fixed size table of {zobrist_hash : score}
+eval_table = EvalTable()
+
+# Killer move cache, stores beta cutoff moves for move ordering in sibling nodes,
+# KILLER_SLOTS encoded moves for every distance from the root with 0 for an empty slot
+killer_moves = None
 
-# Killer move cache, stores beta cutoff moves for move ordering in sibling nodes
-killer_moves = []
+# Refutation move cache, the encoded move that refuted our previous move, indexed by its from | to << 6
+countermove_table = None
 
-# Refutation move cache
-countermove_table = []
+# History heuristic table, indexed by side to move << 12 | from | to << 6
+history_table = None
 
-# History heuristic table
-history_table = []
+# The transposition table and move ordering tables are kept between searches in the same game
+# since most of what we learned searching the last move still applies, they're only reset here
+def new_game():
+	# Clear the transposition table
+	position_table.clear()
+
+	reset_move_ordering()
+
+	for process, jobs in helpers:
+		jobs.put(("newgame",))
+
+def reset_move_ordering():
+	global killer_moves
+	global countermove_table
+	global history_table
+	global root_ply
+
+	# Empty killer moves cache
+	killer_moves = array("H", bytes(MAX_DEPTH * KILLER_SLOTS * 2))
+	root_ply = None
+
+	# Setup refutation butterfly table
+	countermove_table = array("H", bytes(64 * 64 * 2))
+
+	# Setup history butterfly table
+	history_table = array("i", bytes(2 * 64 * 64 * 4))
+
+# Lazy SMP helper processes searching alongside the main search, list of (process, job queue)
+helpers = []
+
+# Queue the helpers report their results to when they finish a search
+helper_results = None
+
+# Shared array of how many nodes each helper has searched
+helper_nodes = None
+
+# Shared event telling the helpers to stop searching
+helper_stop = None
+
+# Which helper this process is, None in the main process
+helper_id = None
+
+# Node count at which a helper next checks if it should stop
+helper_poll = 0
+
+new_game()
 
 # Set to true whenever we want to cut off a current search immediately
 stop = True
@@ -205,10 +482,35 @@ stop = True
 # Selective depth
 seldepth = 0
 
-allowed_movetime = None
+# Decides when the search is out of time, set up from the go command
+time_manager = TimeManager()
+
+# Deepest iteration to search, from go depth
+allowed_depth = None
+
+# Most nodes to search, from go nodes
+allowed_nodes = None
+
+# Set while searching on the opponents time after go ponder, until ponderhit or stop
+pondering = False
+
+# Number of best lines to search and report, from the MultiPV option
+multi_pv = 1
+
+# Moves skipped at the root, the best moves of the lines already searched in this iteration
+excluded_root_moves = set()
+
+# Best move found by the last search of the root
+root_best_move = None
+
+# Set on ponderhit or stop, a ponder search that finishes early waits on it before reporting its best move
+ponder_event = threading.Event()
+
+# Set once a search has reset its state and started, cleared by the UCI front end before it starts one
+search_started = threading.Event()
 
 
-def alpha_beta(board, depth, level, alpha, beta, can_null_move=True):
+def alpha_beta(position, depth, level, alpha, beta, can_null_move=True):
 	"""
 	Alpha Beta Minimax Search
 
@@ -221,6 +523,7 @@ def alpha_beta(board, depth, level, alpha, beta, can_null_move=True):
 		return # Immediately return up the stack if stopped
 	
 	global nodes
+	global root_best_move
 	nodes += 1
 
 	alpha_orig = alpha
@@ -237,19 +540,25 @@ def alpha_beta(board, depth, level, alpha, beta, can_null_move=True):
 		if alpha >= beta:
 			return alpha
 
-	pt_hash = chess.polyglot.zobrist_hash(board) # Retrieve entry from the transposition table
-	pt_entry = position_table.get(pt_hash)
+	pt_hash = position.zobrist_hash # Retrieve entry from the transposition table
+	pt_entry = position_table.probe(pt_hash, level)
+	stats[STAT_TT_PROBES] += 1
 	
 	pt_best_move = None
 
 	# If we have logged this board in the transposition table already, we can load its bounds and make use of them
 	if pt_entry is not None:
+		stats[STAT_TT_HITS] += 1
+
 		if pt_entry[LEAF_DIST] >= depth and not pv_node:
 			if pt_entry[FLAG] == LOWER and pt_entry[VALUE] >= beta:
+				stats[STAT_TT_CUTOFFS] += 1
 				return beta
 			elif pt_entry[FLAG] == UPPER and pt_entry[VALUE] <= alpha:
+				stats[STAT_TT_CUTOFFS] += 1
 				return alpha
 			elif pt_entry[FLAG] == EXACT:
+				stats[STAT_TT_CUTOFFS] += 1
 				return pt_entry[VALUE]
 
 		# This will be used later in move ordering, its generally good to try the best move we found last time
@@ -257,26 +566,49 @@ def alpha_beta(board, depth, level, alpha, beta, can_null_move=True):
 		pt_best_move = pt_entry[BEST_MOVE]
 		score = pt_entry[VALUE]
 
+	# Endgame tablebases know the exact result right after a capture or pawn move, so there's nothing left to search
+	if tablebase is not None and level != 0 and chess.popcount(position.occupied) <= syzygy_probe_limit and position.halfmove_clock == 0 and not position.castling:
+		wdl = tablebase.get_wdl(position.board())
+
+		if wdl is not None:
+			stats[STAT_TB_HITS] += 1
+
+			# Cursed wins and blessed losses are draws by the fifty move rule, so they're scored barely off a draw
+			if wdl == 2:
+				score = TABLEBASE_WIN - level
+			elif wdl == -2:
+				score = -TABLEBASE_WIN + level
+			else:
+				score = wdl
+
+			position_table.store(pt_hash, level, EXACT, MAX_DEPTH, score, None)
+			return score
+
 	# If we've reached our max depth or the game is over, perform a quiescence search
 	# If the game is over, the quiescence search will just immediately return the evaluated board anyway
 	if depth <= 0:
-		return quiescence(board, depth, level, alpha, beta)
+		return quiescence(position, depth, level, alpha, beta)
 	
+	# Draws that don't need the move list, the root is never scored as one so we always have a move to play
+	if level != 0 and (position.is_repetition() or position.is_fifty_moves() or position.is_insufficient_material()):
+		position_table.store(pt_hash, level, EXACT, depth, 0, None)
+		return 0
+
 	futility_prunable = False
 
-	outcome = board.outcome()
-	is_check = board.is_check()
+	is_check = position.is_check()
 
-	if not pv_node and outcome is None and not is_check:
+	if not pv_node and not is_check:
 		# Null move reduction
 		if can_null_move and level != 0 and depth >= 3:
-			if score is None: score = score_board(board)
+			if score is None: score = score_board(position)
 			nmp_reduction = int(3 + depth / 3 + min((score - beta)/200, 3)) # some magical math that just works
 
 			if nmp_reduction > 0:
-				board.push(chess.Move.null())
-				score = alpha_beta(board, depth - nmp_reduction, level+1, -beta, -beta+1, can_null_move=False)
-				board.pop()
+				stats[STAT_NULL_MOVE_SEARCHES] += 1
+				position.make_null()
+				score = alpha_beta(position, depth - nmp_reduction, level+1, -beta, -beta+1, can_null_move=False)
+				position.unmake()
 
 				if score is None:
 					return
@@ -284,57 +616,65 @@ def alpha_beta(board, depth, level, alpha, beta, can_null_move=True):
 				score = -score
 				
 				if score >= beta and not is_mate_score(score):
+					stats[STAT_NULL_MOVE_CUTOFFS] += 1
 					return beta
 		
 		# futility pruning
 		if depth <= FUTILITY_DEPTH:
-			if score is None: score = score_board(board)
+			if score is None: score = score_board(position)
 			if score + FUTILITY_MARGINS[depth] < alpha:
 				futility_prunable = True
 
 		# reverse futility pruning
 		if depth <= REVERSE_FUILITY_DEPTH:
-			if score is None: score = score_board(board)
+			if score is None: score = score_board(position)
 			if score - REVERSE_FUTILTIY_MARGINS[depth] > beta:
+				stats[STAT_REVERSE_FUTILITY_CUTOFFS] += 1
 				return score
 
-	if outcome is not None or board.can_claim_threefold_repetition() or board.can_claim_fifty_moves():
-		score = -CHECKMATE + level if (outcome is not None and outcome.termination == Termination.CHECKMATE) else 0
-		if pt_entry is not None or len(position_table) < MAX_PTABLE_SIZE:
-			position_table[pt_hash] = (EXACT, depth, score, None)
-		
-		return score
-	
 	move_count = 0
 
+	# Root entries are only stored while searching every move, otherwise they'd be missing the best lines of a MultiPV search
+	store_root = level != 0 or not excluded_root_moves
+
 	# Keep track of the best board we evaluate so we can return it with its full move stack later
 	best_move = None
 	best_score = -CHECKMATE-1
 
-	# Iterate through all legal moves sorted
-	for move in sorted_moves(list(board.legal_moves), board, level, pt_best_move=pt_best_move):
+	# Iterate through all moves sorted
+	for move, losing_capture in staged_moves(position, level, pt_best_move=pt_best_move):
+		if level == 0 and move in excluded_root_moves:
+			continue
+
+		# Pruning and reductions look at the move before it's made, captures that lose material are treated like quiet moves
+		quiet = not is_check and is_quiet_move(position, move)
+		reducible = quiet or (losing_capture and not is_check)
+
+		# Moves are only pseudo-legal, the ones that leave our king in check are found out here and skipped
+		if not position.make(move):
+			continue
+
 		move_count += 1
 
 		# Futility pruning
-		if futility_prunable and not is_mate_score(alpha) and not is_mate_score(beta) and not is_check and is_quiet_move(board, move):
+		if futility_prunable and not is_mate_score(alpha) and not is_mate_score(beta) and reducible:
+			position.unmake()
+			stats[STAT_FUTILITY_PRUNES] += 1
 			continue
 
 		# Late move reduction
 		reduction = 0
-		if move_count >= (LATE_MOVE_REDUCTION_MOVES + int(pv_node) * 2) and not is_check and depth >= LATE_MOVE_REDUCTION_LEAF_DISTANCE and is_quiet_move(board, move):
+		if move_count >= (LATE_MOVE_REDUCTION_MOVES + int(pv_node) * 2) and depth >= LATE_MOVE_REDUCTION_LEAF_DISTANCE and reducible:
 			reduction = LATE_MOVE_REDUCTION_TABLE[min(depth, LATE_MOVE_REDUCTION_TABLE_SIZE-1)][min(move_count, LATE_MOVE_REDUCTION_TABLE_SIZE-1)]
 
-		# Principal variation search
-		board.push(move)
+			if reduction > 0:
+				stats[STAT_LMR_REDUCTIONS] += 1
 
-		if outcome is not None:
-			score = -CHECKMATE + level if outcome.termination == Termination.CHECKMATE else 0
-		else:
-			score = alpha_beta(board, depth-1-reduction, level+1, -alpha-1, -alpha)
-		
-		board.pop()
+		# Principal variation search
+		score = alpha_beta(position, depth-1-reduction, level+1, -alpha-1, -alpha)
 
 		if score is None:
+			position.unmake()
 			return
 		
 		# This is for negamax, which is a minimax framework where we can just negate the score
@@ -344,39 +684,46 @@ def alpha_beta(board, depth, level, alpha, beta, can_null_move=True):
 
 		if (score > alpha) and (score < beta):
 			# Evaluate the move by recursively calling alpha beta
-			board.push(move)
-			score = alpha_beta(board, depth-1, level+1, -beta, -alpha)
-			board.pop()
+			stats[STAT_RESEARCHES] += 1
+			score = alpha_beta(position, depth-1, level+1, -beta, -alpha)
 
 			if score is None:
+				position.unmake()
 				return
 
 			score = -score
 
+		position.unmake()
+
 		# Alpha beta pruning cutoff, if weve found the opponent can force a move thats
 		# worse for us than they can force in a previous board state we analyzed, then
 		# we dont need to evaluate this subtree any further because we know they will
 		# always play that move thats worse for us, or something even worse
 		if score >= beta:
-			if not is_check and is_quiet_move(board, move):
-				# Killer move heuristic
-				killer_moves[level].insert(0, move)
+			stats[STAT_BETA_CUTOFFS] += 1
+			if move_count == 1:
+				stats[STAT_FIRST_MOVE_CUTOFFS] += 1
 
-				if len(killer_moves[level]) > MAX_KILLER_MOVES:
-					killer_moves[level].pop()
+			if quiet:
+				# Killer move heuristic, a new killer moves the last one down to the second slot
+				killer_index = level * KILLER_SLOTS
+				if killer_moves[killer_index] != move:
+					killer_moves[killer_index+1] = killer_moves[killer_index]
+					killer_moves[killer_index] = move
 
 				# History heuristic
-				history_table[board.turn][move.from_square][move.to_square] += depth*depth
+				history_index = (position.turn << 12) | (move & 0xFFF)
+				history_table[history_index] += depth*depth
 
-				if history_table[board.turn][move.from_square][move.to_square] >= MAX_HISTORY_VALUE:
+				if history_table[history_index] >= MAX_HISTORY_VALUE:
 					shrink_history(history_table)
 				
 				# Countermove heuristic
-				if len(board.move_stack) >= 2:
-					countermove_table[board.move_stack[-2].from_square][board.move_stack[-2].to_square] = move
+				if len(position.history) >= 2:
+					countermove_table[position.history[-2][0] & 0xFFF] = move
 
-			if pt_entry is not None or len(position_table) < MAX_PTABLE_SIZE:
-				position_table[pt_hash] = (LOWER, depth, beta, move)
+			if store_root:
+				position_table.store(pt_hash, level, LOWER, depth, beta, move)
 
 			return beta
 	
@@ -388,15 +735,26 @@ def alpha_beta(board, depth, level, alpha, beta, can_null_move=True):
 			if score > alpha:
 				alpha = score
 
+	# The line reported for the root starts with this move, so it's always from the search that just finished
+	if level == 0:
+		root_best_move = best_move
+
+	# Without a single legal move the game is over, checkmate if we're in check and stalemate otherwise
+	if move_count == 0:
+		score = -CHECKMATE + level if is_check else 0
+		position_table.store(pt_hash, level, EXACT, depth, score, None)
+
+		return score
+
 	# Update the transposition table with the new information we've learned about this position
-	if pt_entry is not None or len(position_table) < MAX_PTABLE_SIZE:
-		flag = UPPER if alpha <= alpha_orig else EXACT 
-		position_table[pt_hash] = (flag, depth, alpha, best_move)
+	flag = UPPER if alpha <= alpha_orig else EXACT 
+	if store_root:
+		position_table.store(pt_hash, level, flag, depth, alpha, best_move)
 
 	return alpha
 
 
-def quiescence(board, depth, level, alpha, beta):
+def quiescence(position, depth, level, alpha, beta):
 	"""
 	Quiescence Search
 
@@ -412,12 +770,13 @@ def quiescence(board, depth, level, alpha, beta):
 	global nodes
 	global seldepth
 	nodes += 1
+	stats[STAT_QNODES] += 1
 
 	if level > seldepth:
 		seldepth = level
 
 	# Get the positional evaluation of the current board
-	score = score_board(board)
+	score = score_board(position)
 
 	# We beta cutoff early in quiescence, known as "standing pat"
 	if score >= beta:
@@ -433,19 +792,34 @@ def quiescence(board, depth, level, alpha, beta):
 	# Filter moves to only be "loud" moves including captures, promotions or checks
 	# We only search checks up to a certain depth to avoid searching check repetitions
 	# We only really care about tactical checks anyway like forks or discovered checks, etc.
-	loud_from_check = (-depth <= QUIESCENCE_CHECK_DEPTH_LIMIT) and board.is_check()
+	loud_from_check = (-depth <= QUIESCENCE_CHECK_DEPTH_LIMIT) and position.is_check()
 
-	sorted_quiescence_moves = sorted_moves(
-		[move for move in board.legal_moves if loud_from_check or not is_quiet_move(board, move, quiescence_depth=-depth)],
-		board,
-		level
-	)
+	phase = game_phase(position)
+	scored_moves = []
+
+	for move in position.generate_moves():
+		if not loud_from_check and is_quiet_move(position, move, quiescence_depth=-depth):
+			continue
+
+		# Each move is scored once, which also tells us from the static exchange evaluation whether a capture loses material
+		move_score = score_move(position, move, level, phase)
+
+		# Unless we're escaping check, captures which lose material are skipped
+		if not loud_from_check and move_score < LOSING_CAPTURE_SCORE:
+			continue
+
+		scored_moves.append((move_score, move))
+
+	scored_moves.sort(key=lambda scored: scored[0], reverse=True)
 
 	# Same as the alpha beta negamax search
-	for move in sorted_quiescence_moves:
-		board.push(move)
-		score = -quiescence(board, depth-1, level+1, -beta, -alpha)
-		board.pop()
+	for _, move in scored_moves:
+		# Moves that leave our king in check are only found out when they're made
+		if not position.make(move):
+			continue
+
+		score = -quiescence(position, depth-1, level+1, -beta, -alpha)
+		position.unmake()
 
 		if score >= beta:
 			return beta
@@ -456,9 +830,64 @@ def quiescence(board, depth, level, alpha, beta):
 	return alpha
 
 def halted():
-	return stop or (allowed_movetime is not None and int((time.time()-search_start_time) * 1000) >= allowed_movetime)
+	global stop
+	global helper_poll
 
-def iterative_deepening(board):
+	# Helpers only check the stop event shared between processes every so often since it is slow
+	if helper_id is not None and nodes >= helper_poll:
+		helper_poll = nodes + HELPER_POLL_NODES
+		helper_nodes[helper_id] = nodes
+
+		if helper_stop.is_set():
+			stop = True
+
+	return stop or time_manager.halted(nodes) or (allowed_nodes is not None and nodes >= allowed_nodes)
+
+def aspiration_search(position, depth, gamma):
+	"""
+	Aspiration Windows
+
+	Searches the root at the given depth, from depth ASPIRATION_WINDOW_DEPTH on
+	inside a window around gamma, our guess of the score, which is widened and
+	searched again whenever the score falls outside of it. Returns None if the
+	search was stopped.
+	"""
+
+	if depth < ASPIRATION_WINDOW_DEPTH:
+		return alpha_beta(position, depth, 0, -CHECKMATE, CHECKMATE)
+
+	aspw_lower = -ASPIRATION_WINDOW_DEFAULT
+	aspw_higher = ASPIRATION_WINDOW_DEFAULT
+
+	while True:
+		# We set our bounds to be the size of our aspiration window around our guess (gamma)
+		alpha = gamma + aspw_lower
+		beta = gamma + aspw_higher
+
+		# Perform the alpha beta search
+		score = alpha_beta(position, depth, 0, alpha, beta)
+
+		# If this happens it means we stopped mid search so just end the search
+		if score is None:
+			return None
+
+		# Our next aspiration table guess is the value we gave the board at this depth
+		# because we would expect it shouldn't change too much in the next depth	
+		gamma = score
+
+		# If we end up outside the aspiration window bounds, we need to make them wider and re search
+		if score <= alpha or score >= beta:
+			stats[STAT_ASPIRATION_RESEARCHES] += 1
+
+		if score <= alpha:
+			aspw_lower *= ASPIRATION_INCREASE_EXPONENT
+		elif score >= beta:
+			aspw_higher *= ASPIRATION_INCREASE_EXPONENT
+		else:
+			# If were inside the bounds, then we can proceed to the next depth
+			return score
+
+def iterative_deepening(board, report=True, on_iteration=None):
 	"""
 	Iterative Deepening
 
@@ -471,7 +900,11 @@ def iterative_deepening(board):
 	then we detect that the search has failed outside of our tight bound
 	and we have to widen the bound and do a costly research. The default
 	aspiration window size and growth rates can be tuned to give the best
-	performance from this technique.
+	performance from this technique. Reports to the GUI over UCI unless report
+	is False, and calls on_iteration(depth, score, best move, time in ms, nodes)
+	after every completed iteration if given, returns the best move. The board
+	is a python-chess board, the search itself runs on a Position made from it
+	and only the reported lines and moves are converted back.
 	"""
 
 	# We're starting a search so reset some variables
@@ -479,129 +912,835 @@ def iterative_deepening(board):
 	global nodes
 	global search_start_time
 	global killer_moves
-	global countermove_table
-	global history_table
 	global seldepth
+	global root_ply
 
 	search_start_time = time.time()
+	time_manager.start(search_start_time)
 	stop = False
 	nodes = 0
 	depth = STARTING_DEPTH
+
+	# Lets the UCI front end know the search is running, so a stop sent right after go isn't lost
+	search_started.set()
 	bestmove = None
+	bestmove_depth = 0
 
-	# Clear the transposition table
-	position_table.clear()
+	# Age the transposition table so entries from previous searches get replaced first
+	position_table.new_search()
 
-	# Fill killer moves cache with None
-	killer_moves = [[] for _ in range(MAX_DEPTH)]
+	# Killer moves are stored by distance from the root, so they're shifted by how far the root moved since the last search.
+	# That's two plies after our last move, but none after a ponder miss since the ponder search was already a move ahead.
+	shift = 2 if root_ply is None else max(0, min(MAX_DEPTH, board.ply() - root_ply))
+	killer_moves = killer_moves[shift * KILLER_SLOTS:] + array("H", bytes(shift * KILLER_SLOTS * 2))
+	root_ply = board.ply()
 
-	# Setup refutation butterfly table
-	countermove_table = [[None for i in range(64)] for j in range(64)]
+	# Decay history so the previous search still guides move ordering without drowning out this one
+	shrink_history(history_table)
 
-	# Setup history butterfly table
-	history_table = [[[0 for i in range(64)] for j in range(64)] for k in range(2)]
+	stats[:] = [0] * len(STAT_NAMES)
+	pawn_table.reset_stats()
+	eval_table.reset_stats()
+
+	# Start the helpers searching the same position, filling the shared transposition table as they go
+	if helpers:
+		helper_stop.clear()
+		job = ("search", board.root().fen(), [move.uci() for move in board.move_stack], position_table.generation)
+
+		for i, (process, jobs) in enumerate(helpers):
+			helper_nodes[i] = 0
+			jobs.put(job)
+
+	position = Position(board)
 
 	# This is our first aspiration window guess, before we search depth 1
-	gamma = score_board(board)
+	gamma = score_board(position)
+
+	# With MultiPV every line keeps its own guess, there can't be more lines than legal moves
+	lines = max(1, min(multi_pv, board.legal_moves.count()))
+	gammas = [gamma] * lines
 
 	# Iterative deepening
-	while not halted() and depth < MAX_DEPTH:
+	while not halted() and depth < MAX_DEPTH and (allowed_depth is None or depth <= allowed_depth):
 		seldepth = 0
 
-		aspw_lower = -ASPIRATION_WINDOW_DEFAULT
-		aspw_higher = ASPIRATION_WINDOW_DEFAULT
+		# Every line after the first searches the root without the moves of the lines before it,
+		# sharing the transposition table, killers and history with them
+		results = []
+		excluded_root_moves.clear()
 
-		if depth >= ASPIRATION_WINDOW_DEPTH:
-			while True:
-				# We set our bounds to be the size of our aspiration window around our guess (gamma)
-				alpha = gamma + aspw_lower
-				beta = gamma + aspw_higher
+		for line in range(lines):
+			score = aspiration_search(position, depth, gammas[line])
 
-				# Perform the alpha beta search
-				score = alpha_beta(board, depth, 0, alpha, beta)
+			if score is None or root_best_move is None:
+				break
 
-				# If this happens it means we stopped mid search so just end the search
-				if score is None:
-					break
+			# The root entry may not be stored, while moves are excluded, or may have been replaced since,
+			# so every line starts with the move the root search returned and follows the table from there
+			position.make(root_best_move)
+			pv_line = [root_best_move] + generate_pv_line(position, position_table)
+			position.unmake()
 
-				# Our next aspiration table guess is the value we gave the board at this depth
-				# because we would expect it shouldn't change too much in the next depth	
-				gamma = score
+			excluded_root_moves.add(pv_line[0])
+			results.append((score, pv_line))
 
-				# If we end up outside the aspiration window bounds, we need to make them wider and re search
-				if score <= alpha:
-					aspw_lower *= ASPIRATION_INCREASE_EXPONENT
-				elif score >= beta:
-					aspw_higher *= ASPIRATION_INCREASE_EXPONENT
-				else:
-					# If were inside the bounds, then we can proceed to the next depth
-					break
-				
-		else:
-			score = alpha_beta(board, depth, 0, -CHECKMATE, CHECKMATE)
-			gamma = score
+		excluded_root_moves.clear()
 
+		if len(results) == lines:
+			# Lines found later can still turn out better than earlier ones, so they're reported best first
+			results.sort(key=lambda result: result[0], reverse=True)
+			gammas = [score for score, _ in results]
+			score, pv_line = results[0]
+
+			total_nodes = nodes + (sum(helper_nodes) if helpers else 0)
 
-		# UCI reporting
-		if score is not None:
-			pv_line = generate_pv_line(board, position_table)
 			depth_string = f"depth {depth} seldepth {seldepth}" # full search depth / quiescence search depth
 			time_string = f"time {int((time.time()-search_start_time) * 1000)}" # time spent searching this position
-			hashfull_string = f"hashfull {int(len(position_table) / MAX_PTABLE_SIZE * 1000)}" # how full the transposition table is
-			pv_string = f"pv {' '.join([str(move) for move in pv_line])}" # move preview
-			nodes_per_second = int(nodes / (time.time()-search_start_time))
+			hashfull_string = f"hashfull {position_table.hashfull()}" # how full the transposition table is
+			nodes_per_second = int(total_nodes / (time.time()-search_start_time))
 
-			bestmove = pv_line[0]
+			bestmove = decode_move(pv_line[0])
+			bestmove_depth = depth
 
-			if is_mate_score(score):
-				# Checkmate is found, report how many moves its in
-				mate_in = math.ceil(len(pv_line) / 2) * COLOR_MOD[score > 0]
-				with threading.Lock(): print(f"info nodes {nodes} nps {nodes_per_second} {time_string} {hashfull_string} {depth_string} score mate {mate_in} {pv_string}")
-			else:
-				# Otherwise just report centipawns score
-				with threading.Lock(): print(f"info nodes {nodes} nps {nodes_per_second} {time_string} {hashfull_string} {depth_string} score cp {score} {pv_string}")
+			if on_iteration is not None:
+				on_iteration(depth, score, bestmove, int((time.time()-search_start_time) * 1000), total_nodes)
+
+			# UCI reporting, one line per PV
+			for line, (line_score, line_pv) in enumerate(results if report else []):
+				pv_string = f"pv {' '.join([decode_move(move).uci() for move in line_pv])}" # move preview
+
+				if is_mate_score(line_score):
+					# Checkmate is found, report how many moves its in
+					score_string = f"score mate {math.ceil(len(line_pv) / 2) * COLOR_MOD[line_score > 0]}"
+				else:
+					# Otherwise just report centipawns score
+					score_string = f"score cp {line_score}"
+
+				send(f"info nodes {total_nodes} nps {nodes_per_second} {time_string} {hashfull_string} tbhits {stats[STAT_TB_HITS]} {depth_string} multipv {line+1} {score_string} {pv_string}")
+
+			# Don't start another iteration if we won't have the time for it
+			if not time_manager.next_iteration(bestmove, score):
+				break
 
 		# Prepare for the next search
 		depth += 1
+
+	if helpers:
+		# Stop the helpers and take the best move from whoever completed the deepest search
+		helper_stop.set()
+
+		waiting = len(helpers)
+		deadline = time.time() + HELPER_RESULT_TIMEOUT
+
+		while waiting:
+			try:
+				generation, helper_depth, helper_score, helper_move = helper_results.get(timeout=HELPER_RESULT_POLL)
+			except queue.Empty:
+				# A helper that died or hangs never reports, so rather than waiting forever we go with what we have
+				if time.time() >= deadline or not all(process.is_alive() for process, jobs in helpers):
+					send("info string a helper search didn't report, using the main search")
+					break
+				continue
+
+			# Late results from an earlier search we stopped waiting on
+			if generation != position_table.generation:
+				continue
+
+			waiting -= 1
+			helper_move = decode_move(helper_move)
+
+			if helper_depth > bestmove_depth and helper_move is not None and board.is_legal(helper_move):
+				bestmove = helper_move
+				bestmove_depth = helper_depth
 	
 	if bestmove is None: # if we didn't find a best move in time use move ordering
-		bestmove = sorted_moves(list(board.legal_moves), board, 0)[0]
-	
-	# When we end our search (due to stop command or running out of time), report the best move we found
-	with threading.Lock(): print(f"bestmove {bestmove.uci()}")
+		bestmove = decode_move(sorted_moves(position.legal_moves(), position, 0)[0])
+
+	# A ponder search isn't allowed to report its best move before the ponderhit or stop
+	if pondering:
+		ponder_event.wait()
+
+	if report:
+		if stats_enabled:
+			report_stats()
+
+		if stats_file:
+			with open(stats_file, "a") as f:
+				f.write(json.dumps({"fen": board.fen(), "depth": bestmove_depth, "time": int((time.time()-search_start_time) * 1000), **search_stats()}) + "\n")
+
+		# When we end our search (due to stop command or running out of time), report the best move we found
+		# along with the reply we expect, which the GUI may let us ponder on
+		reply = expected_reply(position, encode_move(bestmove))
+
+		if reply is not None:
+			send(f"bestmove {bestmove.uci()} ponder {reply.uci()}")
+		else:
+			send(f"bestmove {bestmove.uci()}")
 	
 	stop = True
 
+	return bestmove
+
+
+def expected_reply(position, move):
+	# The opponents best reply to our encoded move as far as the transposition table knows, None if it doesn't
+	if not position.make(move):
+		return None
+
+	entry = position_table.probe(position.zobrist_hash)
+	reply = entry[BEST_MOVE] if entry is not None else None
 
-# The board used by UCI commands
+	# The entry could be from another position with the same index, so the reply has to be a move we can make here
+	if reply is not None and position.is_pseudo_legal(reply) and position.make(reply):
+		position.unmake()
+	else:
+		reply = None
+
+	position.unmake()
+
+	return decode_move(reply)
+
+
+def search_stats():
+	"""
+	Returns the statistics of the last search in the main process as a dict
+	of the raw counters along with the rates derived from them
+	"""
+
+	result = dict(zip(STAT_NAMES, stats))
+	result["nodes"] = nodes
+	result["main_nodes"] = nodes - stats[STAT_QNODES]
+
+	# How often the first move searched was good enough for a cutoff, a measure of move ordering quality
+	result["first_move_cutoff_rate"] = stats[STAT_FIRST_MOVE_CUTOFFS] / max(stats[STAT_BETA_CUTOFFS], 1)
+	result["tt_hit_rate"] = stats[STAT_TT_HITS] / max(stats[STAT_TT_PROBES], 1)
+	result["qnode_ratio"] = stats[STAT_QNODES] / max(result["main_nodes"], 1)
+	result["evals_per_node"] = stats[STAT_EVALS] / max(nodes, 1)
+
+	result["eval_cache_hits"] = eval_table.hits
+	result["eval_cache_hit_rate"] = eval_table.hit_rate()
+	result["pawn_hash_hits"] = pawn_table.hits
+	result["pawn_hash_hit_rate"] = pawn_table.hit_rate()
+
+	return result
+
+def report_stats():
+	s = search_stats()
+
+	send(f"info string stats nodes {s['nodes']} main {s['main_nodes']} quiescence {s['qnodes']} qratio {s['qnode_ratio']:.2f} evals {s['evals']} evalspernode {s['evals_per_node']:.2f}")
+	send(f"info string stats tt probes {s['tt_probes']} hits {s['tt_hits']} hitrate {s['tt_hit_rate']:.3f} cutoffs {s['tt_cutoffs']}")
+	send(f"info string stats ordering betacutoffs {s['beta_cutoffs']} firstmove {s['first_move_cutoffs']} rate {s['first_move_cutoff_rate']:.3f}")
+	send(f"info string stats pruning nullmove {s['null_move_searches']} nullcutoffs {s['null_move_cutoffs']} futility {s['futility_prunes']} reversefutility {s['reverse_futility_cutoffs']}")
+	send(f"info string stats reductions lmr {s['lmr_reductions']} researches {s['researches']} aspiration {s['aspiration_researches']}")
+	send(f"info string stats caches evalcache {s['eval_cache_hits']} rate {s['eval_cache_hit_rate']:.3f} pawnhash {s['pawn_hash_hits']} rate {s['pawn_hash_hit_rate']:.3f}")
+
+
+def helper_search(position):
+	"""
+	Lazy SMP Helper Search
+
+	Helpers run the same iterative deepening as the main search on the same
+	position without reporting anything, every other helper a ply ahead, so
+	the processes spread out over different parts of the tree and fill the
+	shared transposition table with results the others can reuse. Returns
+	the deepest completed (depth, score, encoded best move).
+	"""
+
+	global stop
+	global nodes
+	global killer_moves
+	global seldepth
+	global helper_poll
+
+	stop = False
+	nodes = 0
+	helper_poll = 0
+	result = (0, 0, 0)
+
+	killer_moves = killer_moves[2 * KILLER_SLOTS:] + array("H", bytes(2 * KILLER_SLOTS * 2))
+	shrink_history(history_table)
+
+	depth = STARTING_DEPTH + (helper_id + 1) % 2
+	gamma = score_board(position)
+
+	while not halted() and depth < MAX_DEPTH:
+		seldepth = 0
+
+		score = aspiration_search(position, depth, gamma)
+
+		if score is not None:
+			gamma = score
+			pt_entry = position_table.probe(position.zobrist_hash)
+
+			if pt_entry is not None and pt_entry[BEST_MOVE] is not None:
+				result = (depth, score, pt_entry[BEST_MOVE])
+
+		depth += 1
+
+	helper_nodes[helper_id] = nodes
+
+	return result
+
+
+def helper_main(index, table_name, table_size, jobs, results, nodes_array, stop_event):
+	"""
+	Entry point of a helper process, waits for searches from the main process
+	"""
+
+	global position_table
+	global helper_id
+	global helper_results
+	global helper_nodes
+	global helper_stop
+	global syzygy_probe_limit
+
+	# Helpers are only ever stopped by the main process
+	time_manager.reset()
+
+	# Swap our own transposition table for the one shared with the main process,
+	# a forked process starts with a copy of the main process table which it mustn't unlink
+	position_table.close(unlink=False)
+	position_table = TranspositionTable.attach(table_name, table_size)
+
+	helper_id = index
+	helper_results = results
+	helper_nodes = nodes_array
+	helper_stop = stop_event
+
+	while True:
+		job = jobs.get()
+
+		if job is None:
+			break
+
+		elif job[0] == "newgame":
+			reset_move_ordering()
+
+		elif job[0] == "syzygy":
+			_, path, probe_limit = job
+			open_tablebase(path)
+			syzygy_probe_limit = probe_limit
+
+		elif job[0] == "search":
+			_, fen, moves, generation = job
+
+			board = chess.Board(fen)
+			for move in moves:
+				board.push(chess.Move.from_uci(move))
+
+			# Results are tagged with the generation so the main search can tell them apart from late ones of an earlier search
+			position_table.generation = generation
+			helper_results.put((generation,) + helper_search(Position(board)))
+
+	position_table.close(unlink=False)
+
+
+def start_helpers(count):
+	"""
+	Starts count helper processes for Lazy SMP, moving the transposition
+	table into shared memory if there are any helpers
+	"""
+
+	global position_table
+	global helpers
+	global helper_results
+	global helper_nodes
+	global helper_stop
+
+	stop_helpers()
+
+	if position_table.shared != (count > 0):
+		size_mb = position_table.size_mb
+		position_table.close()
+		position_table = TranspositionTable(size_mb, shared=count > 0)
+
+	if count == 0:
+		return
+
+	helper_results = multiprocessing.Queue()
+	helper_nodes = multiprocessing.Array("q", count, lock=False)
+	helper_stop = multiprocessing.Event()
+
+	for i in range(count):
+		jobs = multiprocessing.Queue()
+		process = multiprocessing.Process(
+			target=helper_main,
+			args=(i, position_table.name, position_table.size_mb, jobs, helper_results, helper_nodes, helper_stop),
+			daemon=True
+		)
+		process.start()
+		helpers.append((process, jobs))
+
+		if syzygy_path:
+			jobs.put(("syzygy", syzygy_path, syzygy_probe_limit))
+
+def stop_helpers():
+	global helpers
+
+	for process, jobs in helpers:
+		jobs.put(None)
+
+	for process, jobs in helpers:
+		process.join()
+
+	helpers = []
+
+
+def bench(depth=BENCH_DEPTH, hash_size=BENCH_HASH_SIZE):
+	"""
+	Benchmark
+
+	Searches every bench position to a fixed depth from a fresh game with
+	its own transposition table, no helpers, a single PV and no tablebases,
+	so the total node count only changes when the search itself changes. Reports the total nodes,
+	time and nodes per second.
+	"""
+
+	global position_table
+	global helpers
+	global time_manager
+	global allowed_depth
+	global allowed_nodes
+	global multi_pv
+	global tablebase
+
+	# Put the engine's own table, helpers, limits and options aside until we're done
+	saved = (position_table, helpers, time_manager, allowed_depth, allowed_nodes, multi_pv, tablebase)
+	position_table = TranspositionTable(hash_size)
+	helpers = []
+	time_manager = TimeManager()
+	allowed_depth = depth
+	allowed_nodes = None
+	multi_pv = 1
+	tablebase = None
+
+	total_nodes = 0
+	start_time = time.time()
+
+	for i, fen in enumerate(BENCH_POSITIONS):
+		new_game()
+		bestmove = iterative_deepening(chess.Board(fen), report=False)
+		total_nodes += nodes
+
+		send(f"info string bench position {i+1}/{len(BENCH_POSITIONS)} nodes {nodes} bestmove {bestmove.uci()}")
+
+	elapsed = max(time.time() - start_time, 0.001)
+
+	position_table.close()
+	position_table, helpers, time_manager, allowed_depth, allowed_nodes, multi_pv, tablebase = saved
+
+	# The next game mustn't inherit the move ordering of the bench searches
+	new_game()
+
+	send(f"bench depth {depth} nodes {total_nodes} time {int(elapsed * 1000)} nps {int(total_nodes / elapsed)}")
+
+	return total_nodes
+
+
+def perft(board, depth=PERFT_DEPTH, verify=False):
+	"""
+	Perft
+
+	Counts every legal move sequence of the given depth from the board with
+	the internal position class, printing the count under each root move. With
+	verify python-chess counts them again, and any root move where the two
+	disagree is reported so the bug can be narrowed down with a deeper divide.
+	"""
+
+	position = Position(board)
+	total_nodes = 0
+	mismatches = 0
+	start_time = time.time()
+
+	for move in position.generate_moves():
+		if not position.make(move):
+			continue
+
+		count = position.perft(depth - 1)
+		position.unmake()
+		total_nodes += count
+
+		uci_move = decode_move(move)
+		send(f"{uci_move.uci()}: {count}")
+
+		if verify:
+			reference = board.copy(stack=False)
+			reference.push(uci_move)
+			expected = chess_perft(reference, depth - 1)
+
+			if count != expected:
+				mismatches += 1
+				send(f"info string perft mismatch after {uci_move.uci()} counted {count} python-chess {expected}")
+
+	elapsed = max(time.time() - start_time, 0.001)
+
+	if verify:
+		send(f"info string perft verify {'failed' if mismatches else 'passed'}")
+
+	send(f"perft depth {depth} nodes {total_nodes} time {int(elapsed * 1000)} nps {int(total_nodes / elapsed)}")
+
+	return total_nodes
+
+
+def open_book(path):
+	"""
+	Opens a polyglot opening book, python-chess memory maps the file and
+	binary searches its sorted entries, so only the pages we probe are read
+	"""
+
+	global book
+
+	if book is not None:
+		book.close()
+		book = None
+
+	if path:
+		try:
+			book = chess.polyglot.open_reader(path)
+		except OSError as error:
+			send(f"info string could not open book {path}: {error}")
+
+def book_move(board):
+	# Returns a move from the opening book for this position, or None if we're out of book
+	if not own_book or book is None:
+		return None
+
+	try:
+		if book_selection == "weighted":
+			return book.weighted_choice(board).move
+		else:
+			return book.find(board).move
+	except IndexError:
+		return None
+
+
+def open_tablebase(path):
+	"""
+	Opens the syzygy tablebases in the directories of path, separated like
+	PATH is on this system
+	"""
+
+	global tablebase
+	global syzygy_path
+
+	if tablebase is not None:
+		tablebase.close()
+		tablebase = None
+
+	syzygy_path = path
+
+	if path:
+		tablebase = chess.syzygy.Tablebase()
+
+		for directory in path.split(os.pathsep):
+			try:
+				tablebase.add_directory(directory)
+			except OSError as error:
+				send(f"info string could not open tablebases in {directory}: {error}")
+
+def tablebase_move(board):
+	"""
+	Root Tablebase Probe
+
+	Picks the move the DTZ tables say makes the most progress, winning as fast
+	as possible or losing as slowly as possible while keeping the fifty move
+	rule in mind. Returns a tuple of (move, score) or None if the position
+	isn't in the tablebases.
+	"""
+
+	if tablebase is None or chess.popcount(board.occupied) > syzygy_probe_limit or board.castling_rights:
+		return None
+
+	stats[:] = [0] * len(STAT_NAMES)
+	best_key = None
+	best = None
+
+	for move in board.legal_moves:
+		zeroing = board.is_zeroing(move)
+		board.push(move)
+
+		if board.is_checkmate():
+			key = (3, 0)
+		else:
+			dtz = tablebase.get_dtz(board)
+
+			if dtz is None:
+				board.pop()
+				return None
+
+			stats[STAT_TB_HITS] += 1
+
+			# Our distance to zeroing after this move, and how far the fifty move counter already is
+			distance = -dtz
+			clock = 0 if zeroing else board.halfmove_clock
+
+			if distance > 0:
+				wdl = 2 if distance + clock <= 100 else 1
+			elif distance < 0:
+				wdl = -2 if -distance + clock <= 100 else -1
+			else:
+				wdl = 0
+
+			# Win as quickly or lose as slowly as possible
+			key = (wdl, -distance)
+
+		board.pop()
+
+		if best_key is None or key > best_key:
+			best_key = key
+			best = move
+
+	if best is None:
+		return None
+
+	wdl = best_key[0]
+	score = TABLEBASE_WIN if wdl >= 2 else -TABLEBASE_WIN if wdl <= -2 else 0
+
+	return (best, score)
+
+
+# Syzygy tablebases, set with the SyzygyPath option
+tablebase = None
+syzygy_path = None
+syzygy_probe_limit = MAX_SYZYGY_PIECES
+
+# Polyglot opening book reader, set with the BookFile option and used if OwnBook is on
+book = None
+own_book = False
+book_selection = BOOK_SELECTIONS[0]
+
+# The board used by UCI commands, the search makes a Position of its own from it
 board = chess.Board()
 
-# Threads
-search_thread = None
+# Set once the running search has finished and reported its best move, None before the first search
+search_done = None
 
-if __name__ == "__main__":
+
+def read_input(loop, commands):
+	"""
+	Blocking reads of stdin in a thread of their own so the event loop is never
+	held up, None marks the end of input. The file descriptor is read directly
+	rather than through sys.stdin, a thread blocked in sys.stdin holds its lock
+	and a forked helper process would deadlock closing sys.stdin as it starts.
+	"""
+
+	pending = b""
+
+	while True:
+		data = os.read(sys.stdin.fileno(), 4096)
+
+		if not data:
+			break
+
+		*lines, pending = (pending + data).split(b"\n")
+
+		for line in lines:
+			loop.call_soon_threadsafe(commands.put_nowait, line.decode(errors="replace").strip())
+
+	if pending.strip():
+		loop.call_soon_threadsafe(commands.put_nowait, pending.decode(errors="replace").strip())
+
+	loop.call_soon_threadsafe(commands.put_nowait, None)
+
+
+async def write_output():
+	# The single writer, everything queued up is written before flushing once
 	while True:
-		# UCI implementation
-		line = input()
+		lines = [await output_queue.get()]
+
+		while not output_queue.empty():
+			lines.append(output_queue.get_nowait())
+
+		sys.stdout.write("".join(line + "\n" for line in lines))
+		sys.stdout.flush()
+
+		for _ in lines:
+			output_queue.task_done()
+
+
+async def start_search(board):
+	"""
+	Runs a search of the board in a thread of its own, returns an event
+	that is set once the search has reported its best move
+	"""
+
+	loop = asyncio.get_running_loop()
+	done = asyncio.Event()
+
+	def run():
+		try:
+			iterative_deepening(board)
+		finally:
+			loop.call_soon_threadsafe(done.set)
+
+	search_started.clear()
+	threading.Thread(target=run, daemon=True).start()
+
+	# Only returns once the search has reset its state, the wait is next to nothing
+	await asyncio.to_thread(search_started.wait)
+
+	return done
+
+
+async def uci():
+	"""
+	UCI Front End
+
+	Commands are read from stdin by a thread of their own and handled here
+	one by one in an event loop, while the search, bench and perft run in
+	another thread.
+	Everything meant for the GUI, from any thread, goes through a single
+	queue and writer so lines never interleave. stop, isready and ponderhit
+	are answered straight away even during a deep search, a stopped search
+	is never busy waited on, instead commands that change the engine wait
+	on the event the search sets once it has reported its best move.
+	"""
+
+	global output_queue
+	global output_loop
+	global board
+	global search_done
+	global stop
+	global pondering
+	global allowed_depth
+	global allowed_nodes
+	global multi_pv
+	global stats_enabled
+	global stats_file
+	global syzygy_probe_limit
+	global own_book
+	global book_selection
+
+	output_loop = asyncio.get_running_loop()
+	output_queue = asyncio.Queue()
+	commands = asyncio.Queue()
+
+	# bench or perft running in a thread, they don't report a best move so they're awaited on directly
+	command_task = None
+
+	writer = asyncio.create_task(write_output())
+	threading.Thread(target=read_input, args=(output_loop, commands), daemon=True).start()
+
+	while True:
+		# UCI implementation, the end of input is treated like quit
+		line = await commands.get()
+		line = "quit" if line is None else line
 		args = line.split()
 		cmd = args[0] if len(args) else None
 
+		# Anything that changes the engine waits for a running bench or perft to finish, and for a stopped search to report its best move first
+		if cmd not in ("stop", "isready", "ponderhit", "uci", "debug"):
+			if command_task is not None:
+				await command_task
+				command_task = None
+
+			if stop and search_done is not None:
+				await search_done.wait()
+
 		if cmd == "uci":
-			with threading.Lock(): print(f"id name {VERSION}")
-			with threading.Lock(): print(f"id author {AUTHOR}")
-			with threading.Lock(): print("uciok")
+			send(f"id name {VERSION}")
+			send(f"id author {AUTHOR}")
+			send(f"option name Hash type spin default {DEFAULT_HASH_SIZE} min {MIN_HASH_SIZE} max {MAX_HASH_SIZE}")
+			send(f"option name Threads type spin default 1 min 1 max {MAX_THREADS}")
+			send("option name Ponder type check default false")
+			send(f"option name MultiPV type spin default 1 min 1 max {MAX_MULTI_PV}")
+			send("option name Stats type check default false")
+			send("option name StatsFile type string default <empty>")
+			send("option name OwnBook type check default false")
+			send("option name BookFile type string default <empty>")
+			send("option name SyzygyPath type string default <empty>")
+			send(f"option name SyzygyProbeLimit type spin default {MAX_SYZYGY_PIECES} min 0 max {MAX_SYZYGY_PIECES}")
+			send(f"option name BookSelection type combo default {BOOK_SELECTIONS[0]} {' '.join('var ' + selection for selection in BOOK_SELECTIONS)}")
+			send("uciok")
 		
+		elif cmd == "ucinewgame":
+			new_game()
+
+		elif cmd == "debug":
+			# Debug mode verifies every incremental zobrist hash against a full polyglot hash
+			Position.verify_zobrist = "on" in args
+
 		elif cmd == "isready":
-			with threading.Lock(): print("readyok")
+			send("readyok")
 		
+		elif cmd == "setoption":
+			# setoption name <id> [value <x>], option names are case insensitive
+			name, _, value = line.partition(" name ")[2].partition(" value ")
+			name = name.strip().lower()
+			value = value.strip()
+
+			if name == "hash":
+				# Helpers are attached to the old table, so they have to be restarted
+				helper_count = len(helpers)
+				stop_helpers()
+				position_table.resize(int(value))
+				start_helpers(helper_count)
+
+			elif name == "threads":
+				# The main search counts as one thread
+				start_helpers(max(1, min(MAX_THREADS, int(value))) - 1)
+
+			elif name == "multipv":
+				multi_pv = max(1, min(MAX_MULTI_PV, int(value)))
+
+			elif name == "ponder":
+				# Only tells us the GUI may send go ponder, there's nothing to set up for it
+				pass
+
+			elif name == "stats":
+				stats_enabled = value.lower() == "true"
+
+			elif name == "statsfile":
+				# Every search appends a line of JSON to this file
+				stats_file = value if value and value != "<empty>" else None
+
+			elif name == "syzygypath":
+				open_tablebase(value if value != "<empty>" else None)
+
+				for process, jobs in helpers:
+					jobs.put(("syzygy", syzygy_path, syzygy_probe_limit))
+
+			elif name == "syzygyprobelimit":
+				syzygy_probe_limit = max(0, min(MAX_SYZYGY_PIECES, int(value)))
+
+				for process, jobs in helpers:
+					jobs.put(("syzygy", syzygy_path, syzygy_probe_limit))
+
+			elif name == "ownbook":
+				own_book = value.lower() == "true"
+
+			elif name == "bookfile":
+				open_book(value if value != "<empty>" else None)
+
+			elif name == "bookselection":
+				if value.lower() in BOOK_SELECTIONS:
+					book_selection = value.lower()
+
+		elif cmd == "bench":
+			# bench [depth] [hash], not part of UCI but handy to run from a GUI console, run in a thread like a search
+			if stop:
+				command_task = asyncio.create_task(asyncio.to_thread(bench, *int_args(args[1:], 2)))
+
+		elif cmd == "perft" or args[:2] == ["go", "perft"]:
+			# perft [depth] [verify] counts the move tree of the current position, also accepted as go perft
+			if stop:
+				command_task = asyncio.create_task(asyncio.to_thread(perft, board, *int_args(args[args.index("perft")+1:], 1), verify="verify" in args))
+
 		elif cmd == "quit":
 			stop = True
+			ponder_event.set()
+			if search_done is not None:
+				await search_done.wait()
+			stop_helpers()
+			position_table.close()
+			open_book(None)
+			open_tablebase(None)
 			break
 
 		elif cmd == "position":
 			if "fen" in args: # load position from FEN
 				fen = line.split(" fen ")[1].split("moves")[0]
-				board = chess.Board(fen=fen)
+				board = chess.Board(fen)
 			
 			elif "startpos" in args: # standard chess starting position
 				board = chess.Board()
@@ -612,34 +1751,89 @@ if __name__ == "__main__":
 					board.push(chess.Move.from_uci(move))
 				
 		elif cmd == "go":
-			if "movetime" in args:
-				allowed_movetime = int(args[args.index("movetime")+1])
-			elif "wtime" in args and "btime" in args:
-				wtime = int(args[args.index("wtime")+1])
-				btime = int(args[args.index("btime")+1])
-
-				if "winc" in args and "binc" in args:
-					winc = int(args[args.index("winc")+1])
-					binc = int(args[args.index("binc")+1])
-				else:
-					winc = 0
-					binc = 0
-				
-				if board.turn:
-					allowed_movetime = max(min(wtime / 40 + winc, max(wtime / 2 - 1000, 0)), 50)
+			if stop:
+				time_manager.reset()
+
+				if "movetime" in args:
+					time_manager.set_movetime(int(args[args.index("movetime")+1]))
+
+				elif ("wtime" if board.turn else "btime") in args:
+					# Only our own clock matters
+					time_left = int(args[args.index("wtime" if board.turn else "btime")+1])
+					increment = int(args[args.index("winc" if board.turn else "binc")+1]) if ("winc" if board.turn else "binc") in args else 0
+					moves_to_go = int(args[args.index("movestogo")+1]) if "movestogo" in args else None
+
+					time_manager.set_clock(time_left, increment, moves_to_go)
+
+				# Like the clock, the limits of a running search are left alone
+				if "depth" in args:
+					allowed_depth = int(args[args.index("depth")+1])
 				else:
-					allowed_movetime = max(min(btime / 40 + binc, max(btime / 2 - 1000, 0)), 50)
+					allowed_depth = None
 
-			else:
-				allowed_movetime = None
+				if "nodes" in args:
+					allowed_nodes = int(args[args.index("nodes")+1])
+				else:
+					allowed_nodes = None
 			
+			# Searching on the opponents time, the limits only apply after a ponderhit
 			if stop:
+				pondering = "ponder" in args
+				ponder_event.clear()
+				if pondering:
+					time_manager.ponder()
+
+			# Play straight from the opening book if we can, an infinite or ponder search has to wait for stop though
+			move = book_move(board) if stop and "infinite" not in args and not pondering else None
+
+			# Otherwise the tablebases may already know the best move
+			tablebase_result = tablebase_move(board) if move is None and stop and "infinite" not in args and not pondering else None
+
+			if move is not None:
+				send(f"info string book move {move.uci()}")
+				send(f"bestmove {move.uci()}")
+
+			elif tablebase_result is not None:
+				move, score = tablebase_result
+				send(f"info depth 1 tbhits {stats[STAT_TB_HITS]} score cp {score} pv {move.uci()}")
+				send(f"bestmove {move.uci()}")
+
+			elif stop:
 				# Begin our search by starting up the threads
-				search_thread = threading.Thread(target=lambda: iterative_deepening(board), daemon=True)
-				search_thread.start()
+				search_done = await start_search(board)
+
+		elif cmd == "ponderhit":
+			# The opponent played the expected move, the ponder search carries on as a normal timed search
+			if pondering:
+				pondering = False
+				time_manager.ponderhit()
+				ponder_event.set()
 
 		elif cmd == "stop":
-			if not stop:
-				stop = True
-				while search_thread.is_alive():
-					pass
+			# Only stops searches started with go, bench and perft always run to the end so their counts stay comparable
+			if command_task is not None and not command_task.done():
+				continue
+
+			# Also a ponder miss, the best move we report is ignored and the transposition table is kept for the next search
+			# The search reports its best move by itself once it notices, there's no need to wait for it here
+			pondering = False
+			ponder_event.set()
+			stop = True
+
+	# Everything still queued for the GUI is written out before we exit
+	await output_queue.join()
+	writer.cancel()
+
+
+if __name__ == "__main__":
+	if sys.argv[1:2] == ["bench"]:
+		# Command line benchmark, python qchess.py bench [depth] [hash]
+		bench(*int_args(sys.argv[2:], 2))
+		sys.exit()
+
+	if sys.argv[1:2] == ["perft"]:
+		# Command line move generator test from the starting position, python qchess.py perft [depth] [verify]
+		perft(board, *int_args(sys.argv[2:], 1), verify="verify" in sys.argv)
+		sys.exit()
+
+	asyncio.run(uci())
@@ -0,0 +1,125 @@
+import time
+
+from const import *
+
+
+class TimeManager:
+	"""
+	Time Manager
+
+	Decides how long to search a move. From the clock it works out a soft
+	limit, how long we'd like to spend, and a hard limit the search is never
+	allowed to go past. The soft limit is stretched when the best move keeps
+	changing or the score drops between iterations, and no new iteration is
+	started if the growth of the previous iterations says it couldn't finish
+	before the hard limit. The clock is only read every TIME_POLL_NODES nodes
+	since looking at it is slow compared to searching a node.
+
+	Without any limits (go infinite, go depth) the search never runs out of time.
+	While pondering the limits are known but not applied, on a ponderhit the
+	clock starts over since only then is it our own time being spent.
+	"""
+
+	def __init__(self):
+		self.reset()
+
+	def reset(self):
+		self.soft_limit = None
+		self.hard_limit = None
+		self.fixed = False
+		self.pondering = False
+		self.start()
+
+	def set_movetime(self, movetime):
+		# go movetime, use exactly the time we were given
+		self.soft_limit = movetime
+		self.hard_limit = movetime
+		self.fixed = True
+
+	def set_clock(self, time_left, increment=0, moves_to_go=None):
+		"""
+		Sets the limits from the time left on our clock in ms, our increment
+		and how many moves are left until the next time control if there is one
+		"""
+
+		available = max(time_left - TIME_MOVE_OVERHEAD, 0)
+		moves = min(moves_to_go, TIME_MOVES_HORIZON) if moves_to_go else TIME_MOVES_HORIZON
+
+		# With one move left until the time control we can use nearly everything
+		max_usage = TIME_LAST_MOVE_USAGE if moves_to_go == 1 else TIME_MAX_USAGE
+
+		self.hard_limit = max(min(available * max_usage, (available / moves + increment) * TIME_HARD_RATIO), TIME_MIN_MOVETIME)
+		self.soft_limit = max(min(available / moves + increment * TIME_INCREMENT_USAGE, self.hard_limit), TIME_MIN_MOVETIME)
+		self.fixed = False
+
+	def ponder(self):
+		# go ponder, search on the opponents time until ponderhit or stop
+		self.pondering = True
+
+	def ponderhit(self):
+		# The opponent played the move we were pondering on, the search is now running on our clock
+		self.pondering = False
+		self.start_time = time.time()
+		self.next_poll = 0
+		self.iteration_end = 0
+
+	def start(self, start_time=None):
+		self.start_time = time.time() if start_time is None else start_time
+		self.next_poll = TIME_POLL_NODES
+		self.stopped = False
+
+		self.iteration_end = 0
+		self.iteration_time = 0
+		self.instability = 0
+		self.best_move = None
+		self.score = None
+
+	def elapsed(self):
+		return int((time.time() - self.start_time) * 1000)
+
+	def halted(self, nodes):
+		# Only look at the clock every so often, until then the last answer stands
+		if self.hard_limit is None or self.pondering or nodes < self.next_poll:
+			return self.stopped
+
+		self.next_poll = nodes + TIME_POLL_NODES
+		self.stopped = self.elapsed() >= self.hard_limit
+
+		return self.stopped
+
+	def next_iteration(self, best_move, score):
+		"""
+		Called after every completed iteration, returns whether there's
+		enough time left to start the next one
+		"""
+
+		now = self.elapsed()
+		iteration_time = now - self.iteration_end
+		last_iteration_time = self.iteration_time
+		self.iteration_end = now
+		self.iteration_time = iteration_time
+
+		# A best move that keeps changing means the search hasn't settled yet, older changes count for less
+		self.instability *= TIME_INSTABILITY_DECAY
+		if self.best_move is not None and best_move != self.best_move:
+			self.instability += TIME_BEST_MOVE_CHANGE_EXTENSION
+
+		# A falling score means we may be walking into trouble and should look closer
+		score_drop = 0
+		if self.score is not None and score < self.score:
+			score_drop = min((self.score - score) / TIME_SCORE_DROP_SCALE, 1)
+
+		self.best_move = best_move
+		self.score = score
+
+		if self.hard_limit is None or self.fixed or self.pondering:
+			return True
+
+		extension = min((1 + self.instability) * (1 + score_drop * TIME_SCORE_DROP_EXTENSION), TIME_MAX_EXTENSION)
+		target = min(self.soft_limit * extension, self.hard_limit)
+
+		# The next iteration takes about as much longer than this one as this one did than the last
+		branching_factor = iteration_time / last_iteration_time if last_iteration_time > 0 else TIME_DEFAULT_BRANCHING_FACTOR
+		branching_factor = max(TIME_MIN_BRANCHING_FACTOR, min(TIME_MAX_BRANCHING_FACTOR, branching_factor))
+
+		return now < target and now + iteration_time * branching_factor <= self.hard_limit
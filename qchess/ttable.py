@@ -0,0 +1,246 @@
+from array import array
+from multiprocessing import shared_memory
+
+from const import *
+from util import score_to_tt, score_from_tt
+
+
+class TranspositionTable:
+	"""
+	Transposition Table
+
+	A preallocated, fixed size hash table of previously searched positions.
+	Each entry is two unsigned 64 bit words kept in flat arrays, the full
+	zobrist key and a data word packing the best move, score, depth, bound
+	flag and the generation (search) the entry was written in. Entries are
+	grouped in buckets of two, the first slot keeps the deepest entry and
+	the second is always replaced, entries from older generations are
+	replaced first.
+
+	The table can live in shared memory so several search processes can
+	use it at once without any locking. The key word is stored XORed with
+	the data word, so if another process writes half an entry while we are
+	reading it the key won't match and the entry is simply ignored.
+	"""
+
+	def __init__(self, size_mb=DEFAULT_HASH_SIZE, shared=False):
+		self.generation = 0
+		self.shared = shared
+		self.shm = None
+		self.views = []
+		self.resize(size_mb)
+
+	@classmethod
+	def attach(cls, name, size_mb):
+		# Open a shared table created by another process
+		table = cls.__new__(cls)
+		table.generation = 0
+		table.shared = True
+		table.views = []
+		table.set_size(size_mb)
+		table.shm = shared_memory.SharedMemory(name=name)
+		table.map(table.shm.buf)
+		return table
+
+	@property
+	def name(self):
+		return self.shm.name if self.shm is not None else None
+
+	def set_size(self, size_mb):
+		self.size_mb = max(MIN_HASH_SIZE, min(MAX_HASH_SIZE, size_mb))
+		self.buckets = (self.size_mb * 1024 * 1024) // (TT_ENTRY_SIZE * TT_BUCKET_SIZE)
+		self.slots = self.buckets * TT_BUCKET_SIZE
+
+	def map(self, memory):
+		view = memoryview(memory)
+		key_view = view[:self.slots * 8]
+		data_view = view[self.slots * 8:self.slots * TT_ENTRY_SIZE]
+
+		self.keys = key_view.cast("Q")
+		self.data = data_view.cast("Q")
+
+		# Kept so they can be released before shared memory is closed
+		self.views = [self.data, self.keys, data_view, key_view, view]
+
+	def resize(self, size_mb):
+		self.close()
+		self.set_size(size_mb)
+
+		if self.shared:
+			self.shm = shared_memory.SharedMemory(create=True, size=self.slots * TT_ENTRY_SIZE)
+			self.map(self.shm.buf)
+		else:
+			self.map(bytearray(self.slots * TT_ENTRY_SIZE))
+
+	def close(self, unlink=True):
+		for view in self.views:
+			view.release()
+		self.views = []
+
+		if self.shm is not None:
+			self.shm.close()
+			if unlink:
+				self.shm.unlink()
+			self.shm = None
+
+	def clear(self):
+		self.generation = 0
+		self.views[-1][:self.slots * TT_ENTRY_SIZE] = bytes(self.slots * TT_ENTRY_SIZE)
+
+	def new_search(self):
+		# Everything stored before this point becomes replaceable
+		self.generation = (self.generation + 1) % TT_GENERATIONS
+
+	def probe(self, key, level=0):
+		"""
+		Look up a position searched at distance level from the root,
+		returns a tuple of (flag, leaf distance, value, best move) or None
+		"""
+
+		index = (key % self.buckets) * TT_BUCKET_SIZE
+
+		data = self.data[index]
+		if self.keys[index] ^ data != key:
+			data = self.data[index+1]
+			if self.keys[index+1] ^ data != key:
+				return None
+
+		if not data:
+			return None
+
+		return (
+			(data >> TT_FLAG_SHIFT) & 0x3,
+			(data >> TT_DEPTH_SHIFT) & 0xFF,
+			score_from_tt(((data >> TT_SCORE_SHIFT) & 0xFFFFFF) - TT_SCORE_OFFSET, level),
+			(data & 0xFFFF) or None
+		)
+
+	def store(self, key, level, flag, depth, value, best_move):
+		index = (key % self.buckets) * TT_BUCKET_SIZE
+		keys = self.keys
+		table = self.data
+
+		move = best_move or 0
+
+		if keys[index] ^ table[index] == key or keys[index+1] ^ table[index+1] == key:
+			# Overwrite the entry for the same position, keeping its best move if we don't have a new one
+			if keys[index] ^ table[index] != key:
+				index += 1
+			if not move:
+				move = table[index] & 0xFFFF
+
+		else:
+			old = table[index]
+
+			# The depth preferred slot is only taken over by searches at least as deep, or if it is empty or stale
+			if old and ((old >> TT_GENERATION_SHIFT) == self.generation) and (old >> TT_DEPTH_SHIFT) & 0xFF > depth:
+				index += 1
+			else:
+				# Demote whatever was in the depth preferred slot to the always replace slot
+				keys[index+1] = keys[index]
+				table[index+1] = old
+
+		data = (
+			move |
+			((score_to_tt(value, level) + TT_SCORE_OFFSET) << TT_SCORE_SHIFT) |
+			(max(0, min(0xFF, depth)) << TT_DEPTH_SHIFT) |
+			(flag << TT_FLAG_SHIFT) |
+			(self.generation << TT_GENERATION_SHIFT)
+		)
+
+		keys[index] = key ^ data
+		table[index] = data
+
+	def hashfull(self):
+		# Permille of a sample of the table that is filled by the current search
+		sample = min(TT_HASHFULL_SAMPLE, self.slots)
+		used = 0
+
+		for i in range(sample):
+			data = self.data[i]
+			if data and (data >> TT_GENERATION_SHIFT) == self.generation:
+				used += 1
+
+		return used * 1000 // sample
+
+
+class PawnTable:
+	"""
+	Pawn Structure Table
+
+	A small fixed size cache of pawn structure scores keyed by a zobrist
+	key of only the pawns. The pawns only change on a small fraction of
+	moves, so nearly every evaluation finds its pawn structure here.
+	"""
+
+	def __init__(self, size=PAWN_TABLE_SIZE):
+		self.size = size
+		self.keys = array("Q", bytes(size * 8))
+		self.mg_scores = array("i", bytes(size * 4))
+		self.eg_scores = array("i", bytes(size * 4))
+		self.reset_stats()
+
+	def reset_stats(self):
+		self.probes = 0
+		self.hits = 0
+
+	def hit_rate(self):
+		return self.hits / self.probes if self.probes else 0
+
+	def probe(self, key):
+		# Empty entries have a key of 0 with a score of 0, which is exactly right for a board without pawns
+		index = key & (self.size - 1)
+		self.probes += 1
+
+		if self.keys[index] != key:
+			return None
+
+		self.hits += 1
+		return (self.mg_scores[index], self.eg_scores[index])
+
+	def store(self, key, mg, eg):
+		index = key & (self.size - 1)
+		self.keys[index] = key
+		self.mg_scores[index] = mg
+		self.eg_scores[index] = eg
+
+
+class EvalTable:
+	"""
+	Evaluation Table
+
+	A fixed size cache of static evaluations keyed by the full zobrist key.
+	The static evaluation only depends on the position itself, so entries
+	never go stale and a position is only evaluated once until it's evicted.
+	Draws by repetition or the fifty move rule depend on the move history
+	and must be checked before looking a position up here.
+	"""
+
+	def __init__(self, size=EVAL_TABLE_SIZE):
+		self.size = size
+		self.keys = array("Q", bytes(size * 8))
+		self.scores = array("i", bytes(size * 4))
+		self.reset_stats()
+
+	def reset_stats(self):
+		self.probes = 0
+		self.hits = 0
+
+	def hit_rate(self):
+		return self.hits / self.probes if self.probes else 0
+
+	def probe(self, key):
+		index = key & (self.size - 1)
+		self.probes += 1
+
+		# Empty entries have a key of 0, a real position hashing to exactly 0 is astronomically unlikely
+		if self.keys[index] != key:
+			return None
+
+		self.hits += 1
+		return self.scores[index]
+
+	def store(self, key, score):
+		index = key & (self.size - 1)
+		self.keys[index] = key
+		self.scores[index] = score
@@ -1,56 +1,194 @@
+from array import array
+
 import chess
 import chess.polyglot
-from chess import WHITE, BLACK, KING, PAWN
+from chess import WHITE, BLACK, PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING
 
 from const import *
 
 def is_mate_score(score):
 	return abs(score) + 1000 >= CHECKMATE
 
-def is_quiet_move(board, move, quiescence_depth=0):
-	if board.is_capture(move):
+def is_tablebase_score(score):
+	return abs(score) + MAX_DEPTH >= TABLEBASE_WIN and not is_mate_score(score)
+
+def is_quiet_move(position, move, quiescence_depth=0):
+	if position.is_capture(move):
 		return False
 	
-	if (quiescence_depth <= QUIESCENCE_CHECK_DEPTH_LIMIT) and board.gives_check(move):
+	if (quiescence_depth <= QUIESCENCE_CHECK_DEPTH_LIMIT) and position.gives_check(move):
 		return False
 	
-	piece = board.piece_at(move.from_square)
+	piece = position.squares[move & 0x3F]
 
-	if piece.piece_type == PAWN:
-		if chess.square_rank(move.to_square) >= 6 and piece.color == WHITE:
+	if piece & 7 == PAWN:
+		if chess.square_rank((move >> 6) & 0x3F) >= 6 and piece >> 3 == WHITE:
 			return False
-		if chess.square_rank(move.to_square) <= 1 and piece.color == BLACK:
+		if chess.square_rank((move >> 6) & 0x3F) <= 1 and piece >> 3 == BLACK:
 			return False
-		if move.promotion is not None:
+		if move >> 12:
 			return False
 
 	return True
 
+def score_to_tt(score, level):
+	# Mate and tablebase scores are stored relative to the position instead of the root so they stay valid in other searches
+	if is_mate_score(score) or is_tablebase_score(score):
+		return score + level if score > 0 else score - level
+
+	return score
+
+def score_from_tt(score, level):
+	if is_mate_score(score) or is_tablebase_score(score):
+		return score - level if score > 0 else score + level
+
+	return score
+
+def attackers_mask(position, square, occupied):
+	# Pieces of both colors attacking a square, sliding attacks are computed through the given occupancy so x-rays can be found
+	white = position.pieces[WHITE]
+	black = position.pieces[BLACK]
+	queens_and_rooks = white[QUEEN] | black[QUEEN] | white[ROOK] | black[ROOK]
+	queens_and_bishops = white[QUEEN] | black[QUEEN] | white[BISHOP] | black[BISHOP]
+
+	return (
+		(chess.BB_KING_ATTACKS[square] & (white[KING] | black[KING])) |
+		(chess.BB_KNIGHT_ATTACKS[square] & (white[KNIGHT] | black[KNIGHT])) |
+		(chess.BB_RANK_ATTACKS[square][chess.BB_RANK_MASKS[square] & occupied] & queens_and_rooks) |
+		(chess.BB_FILE_ATTACKS[square][chess.BB_FILE_MASKS[square] & occupied] & queens_and_rooks) |
+		(chess.BB_DIAG_ATTACKS[square][chess.BB_DIAG_MASKS[square] & occupied] & queens_and_bishops) |
+		(chess.BB_PAWN_ATTACKS[WHITE][square] & black[PAWN]) |
+		(chess.BB_PAWN_ATTACKS[BLACK][square] & white[PAWN])
+	) & occupied
+
+def see(position, move):
+	"""
+	Static Exchange Evaluation
+
+	Plays out every capture and recapture on the target square of a move,
+	always capturing with the least valuable piece, and returns the material
+	the side to move wins (or loses) in centipawns assuming either side can
+	stop capturing whenever continuing would lose more material.
+	"""
+
+	from_square = move & 0x3F
+	to_square = (move >> 6) & 0x3F
+	promotion = move >> 12
+
+	occupied = position.occupied ^ chess.BB_SQUARES[from_square]
+	moving = position.squares[from_square] & 7
+
+	if moving == PAWN and to_square == position.ep_square:
+		captured = PAWN
+		occupied ^= chess.BB_SQUARES[to_square - 8 if position.turn == WHITE else to_square + 8]
+	else:
+		captured = position.squares[to_square] & 7
+
+	# The value of whatever currently stands on the target square
+	on_square = promotion or moving
+
+	gains = [CP_PIECE_VALUES[captured] + (CP_PIECE_VALUES[promotion] - CP_PIECE_VALUES[PAWN] if promotion else 0)]
+
+	color = not position.turn
+	attackers = attackers_mask(position, to_square, occupied)
+
+	while True:
+		own_attackers = attackers & position.occupied_co[color]
+
+		if not own_attackers:
+			break
+
+		# Recapture with the least valuable attacker
+		for piece_type in (PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING):
+			candidates = own_attackers & position.pieces[color][piece_type]
+			if candidates:
+				break
+
+		# The king can only recapture if the square isn't defended anymore
+		if piece_type == KING and attackers & position.occupied_co[not color]:
+			break
+
+		gains.append(CP_PIECE_VALUES[on_square] - gains[-1])
+		on_square = piece_type
+
+		# Remove the recapturing piece, which might reveal sliding pieces behind it
+		occupied ^= candidates & -candidates
+		attackers = attackers_mask(position, to_square, occupied)
+		color = not color
+
+	# Either side can choose not to recapture, so negamax the gains back down to the first capture
+	while len(gains) > 1:
+		gain = gains.pop()
+		gains[-1] = -max(-gains[-1], gain)
+
+	return gains[0]
+
+def north_fill(bb): # smears every bit up the board towards the eighth rank
+	bb |= bb << 8
+	bb |= bb << 16
+	bb |= bb << 32
+	return bb & chess.BB_ALL
+
+def south_fill(bb): # smears every bit down the board towards the first rank
+	bb |= bb >> 8
+	bb |= bb >> 16
+	bb |= bb >> 32
+	return bb
+
+def file_set(bb): # 8 bit mask of which files have any bits set
+	return south_fill(bb) & 0xFF
+
+def adjacent_files(bb): # spreads a bitboard out to the files on either side
+	return ((bb & ~chess.BB_FILE_A) >> 1) | ((bb & ~chess.BB_FILE_H) << 1)
+
 def lerp(start, end, position): # linear interpolation between start and end
 	return int((1-position) * start + position * end)
 
-def shrink_history(table):
-	for i in range(len(table)):
-		for j in range(len(table[0])):
-			for k in range(len(table[0][0])):
-				table[i][j][k] = table[i][j][k] // HISTORY_SHRINK_FACTOR
+def shrink_history(table): # decays every entry of a flat history array at once
+	table[:] = array(table.typecode, [value // HISTORY_SHRINK_FACTOR for value in table])
 
-def generate_pv_line(board, table):
-	nboard = board.copy()
-	
-	pv = []
+def encode_move(move): # packs a move into 16 bits, from (6) | to (6) | promotion (3)
+	if not move:
+		return 0
+
+	return move.from_square | (move.to_square << 6) | ((move.promotion or 0) << 12)
+
+def decode_move(encoded):
+	if not encoded:
+		return None
 
-	zh = chess.polyglot.zobrist_hash(nboard)
+	return chess.Move(encoded & 0x3F, (encoded >> 6) & 0x3F, (encoded >> 12) or None)
+
+def generate_pv_line(position, table):
+	# Follows the best moves in the table from a position and takes them back again, the moves are left encoded
+	pv = []
 
 	hashes = set()
 
-	while zh in table and zh not in hashes:
-		if table[zh][BEST_MOVE] is not None:
-			pv.append(table[zh][BEST_MOVE])
-			nboard.push(table[zh][BEST_MOVE])
-			hashes.add(zh)
-			zh = chess.polyglot.zobrist_hash(nboard)
-		else:
+	while position.zobrist_hash not in hashes:
+		hashes.add(position.zobrist_hash)
+
+		entry = table.probe(position.zobrist_hash)
+		move = entry[BEST_MOVE] if entry is not None else None
+
+		# Stop at missing entries, or moves that can't be played here which can happen if entries were overwritten
+		if move is None or not position.is_pseudo_legal(move) or not position.make(move):
 			break
+
+		pv.append(move)
+
+	for _ in pv:
+		position.unmake()
 	
 	return pv
+
+def int_args(args, count): # up to count leading integer arguments of a command, the first one that isn't a number ends them
+	values = []
+
+	for arg in args[:count]:
+		if not arg.isdigit():
+			break
+
+		values.append(int(arg))
+
+	return values